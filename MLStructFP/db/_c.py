@@ -7,7 +7,9 @@ Base FP component.
 __all__ = ['BaseComponent']
 
 from MLStructFP.utils import GeomPoint2D
-from MLStructFP._types import List, TYPE_CHECKING, VectorInstance
+from MLStructFP._types import List, Optional, TYPE_CHECKING, VectorInstance
+
+import numpy as np
 
 if TYPE_CHECKING:
     from MLStructFP.db._floor import Floor
@@ -20,6 +22,7 @@ class BaseComponent(object):
     floor: 'Floor'
     id: int
     points: List['GeomPoint2D']
+    _polygon: Optional['np.ndarray']  # Cached points array
 
     def __init__(
             self,
@@ -41,9 +44,23 @@ class BaseComponent(object):
         assert isinstance(y, VectorInstance) and len(y) == len(x)
         self.id = component_id
         self.floor = floor
-        self.points = []
-        for i in range(len(x)):
-            self.points.append(GeomPoint2D(float(x[i]), float(y[i])))
+        self.points = [GeomPoint2D(float(xi), float(yi)) for xi, yi in zip(x, y)]
+        self._clear_cache()
+
+    def _clear_cache(self) -> None:
+        """
+        Clear the cached geometry, it must be called if the points are modified.
+        """
+        self._polygon = None
+
+    def get_polygon(self) -> 'np.ndarray':
+        """
+        :return: Read-only (n, 2) array with the (x, y) coordinates of the points
+        """
+        if self._polygon is None:
+            self._polygon = np.array([(p.x, p.y) for p in self.points], dtype=np.float64)
+            self._polygon.flags.writeable = False
+        return self._polygon
 
     def plot_plotly(self, *args, **kwargs) -> None:
         """
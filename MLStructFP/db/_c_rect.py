@@ -7,14 +7,15 @@ Rectangle component.
 __all__ = ['Rect']
 
 from MLStructFP.db._c import BaseComponent
-from MLStructFP._types import NumberType, NumberInstance, List, TYPE_CHECKING
+from MLStructFP._types import NumberType, NumberInstance, List, Optional, Tuple, TYPE_CHECKING
 from MLStructFP.utils import GeomLine2D, GeomPoint2D
 
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
+import numpy as np
 
 if TYPE_CHECKING:
     from MLStructFP.db._floor import Floor
+    import matplotlib.pyplot as plt
+    import plotly.graph_objects as go
 
 
 class Rect(BaseComponent):
@@ -26,6 +27,7 @@ class Rect(BaseComponent):
     line: GeomLine2D
     thickness: float
     wall: int
+    _mass_center: Optional[Tuple[float, float]]
 
     def __init__(
             self,
@@ -50,13 +52,14 @@ class Rect(BaseComponent):
         :param angle: Rect angle
         :param length: Rect length
         :param thickness: Rect thickness
-        :param x: List of coordinates within x-axis
-        :param y: List of coordinates within y-axis
+        :param x: List of the 4 corner coordinates within x-axis
+        :param y: List of the 4 corner coordinates within y-axis
         :param line_m: Line slope
         :param line_n: Line intercept
         :param line_theta: Line angle
         """
         BaseComponent.__init__(self, rect_id, x, y, floor)
+        assert len(self.points) == 4, f'Rect {rect_id} must have 4 points, but it has {len(self.points)}'
         assert isinstance(wall_id, int) and wall_id > 0
         assert isinstance(angle, NumberInstance)
         assert isinstance(length, NumberInstance) and length > 0
@@ -73,13 +76,27 @@ class Rect(BaseComponent):
         self.wall = wall_id
         # noinspection PyProtectedMember
         self.floor._rect[self.id] = self
+        # noinspection PyProtectedMember
+        self.floor._rect_t = None
+
+    def _clear_cache(self) -> None:
+        """
+        Clear the cached geometry, it must be called if the points are modified.
+        """
+        BaseComponent._clear_cache(self)
+        self._mass_center = None
 
     def get_mass_center(self) -> 'GeomPoint2D':
         """
         Returns the mass center of the rect.
         """
-        return GeomPoint2D(sum(p.x for p in self.points), sum(p.y for p in self.points)).scale(1 / len(self.points))
+        if self._mass_center is not None:
+            return GeomPoint2D(*self._mass_center)
+        c = GeomPoint2D(sum(p.x for p in self.points), sum(p.y for p in self.points)).scale(1 / len(self.points))
+        self._mass_center = (c.x, c.y)
+        return c
 
+    # noinspection PyUnusedLocal
     def plot_plotly(
             self,
             fig: 'go.Figure',
@@ -89,7 +106,8 @@ class Rect(BaseComponent):
             fill: bool = False,
             opacity: NumberType = 1.0,
             color: str = '',
-            show_legend: bool = True
+            show_legend: bool = True,
+            **kwargs
     ) -> None:
         """
         Plot rect.
@@ -102,15 +120,14 @@ class Rect(BaseComponent):
         :param opacity: Object opacity
         :param color: Color, if empty use default object color
         :param show_legend: Add object legend to plot
+        :param kwargs: Optional keyword arguments
         """
-        px, py = [p.x for p in self.points], [p.y for p in self.points]
+        import plotly.graph_objects as go  # Imported on demand, only used to plot
+        px, py = [p.x + dx for p in self.points], [p.y + dy for p in self.points]
         px.append(px[0])
         py.append(py[0])
         if color == '':
             color = '#0000ff'
-        for i in range(len(px)):
-            px[i] += dx
-            py[i] += dy
         _fill = 'none'
         if fill:
             _fill = 'toself'
@@ -125,6 +142,58 @@ class Rect(BaseComponent):
             y=py
         ))
 
+    @staticmethod
+    def plot_plotly_many(
+            fig: 'go.Figure',
+            rects: Tuple['Rect', ...],
+            dx: NumberType = 0,
+            dy: NumberType = 0,
+            name: str = 'Rects',
+            fill: bool = False,
+            opacity: NumberType = 1.0,
+            color: str = '',
+            show_legend: bool = True,
+            polygons: Optional['np.ndarray'] = None
+    ) -> None:
+        """
+        Plot several rects as a single trace, the outlines are split using NaN values. This is much faster
+        than plotting each rect, but the rects cannot be identified within the legend.
+
+        :param fig: Figure object
+        :param rects: Rects to plot
+        :param dx: X displacement
+        :param dy: Y displacement
+        :param name: Trace name
+        :param fill: Fill figure
+        :param opacity: Object opacity
+        :param color: Color, if empty use default object color
+        :param show_legend: Add object legend to plot
+        :param polygons: Precomputed (n, 4, 2) corners of the rects (Floor.get_rect_polygons). If None, compute them
+        """
+        import plotly.graph_objects as go  # Imported on demand, only used to plot
+        if polygons is None:
+            polygons = np.stack([r.get_polygon() for r in rects]) if len(rects) > 0 else np.empty((0, 4, 2))
+        assert len(polygons) == len(rects), 'Each rect must have its polygon'
+
+        # Each outline is closed with its first corner and followed by a gap
+        n, k, _ = polygons.shape
+        xy = np.full((n, k + 2, 2), np.nan)
+        xy[:, :k] = polygons
+        xy[:, k] = polygons[:, 0]
+        xy[:, :k + 1] += (dx, dy)
+        if color == '':
+            color = '#0000ff'
+        fig.add_trace(go.Scatter(
+            fill='toself' if fill else 'none',
+            line=dict(color=color),
+            mode='lines',
+            name=name,
+            opacity=opacity,
+            showlegend=show_legend,
+            x=xy[:, :, 0].reshape(-1),
+            y=xy[:, :, 1].reshape(-1)
+        ))
+
     def plot_matplotlib(
             self,
             ax: 'plt.Axes',
@@ -144,8 +213,8 @@ class Rect(BaseComponent):
         """
         if color == '':
             color = '#000000'
-        px, py = [p.x for p in self.points], [p.y for p in self.points]
+        pts = self.get_polygon()
         if fill:
-            ax.fill(px, py, color=color, lw=None, alpha=alpha)
+            ax.fill(pts[:, 0], pts[:, 1], color=color, lw=None, alpha=alpha)
         else:
-            ax.plot(px, py, color=color, lw=linewidth, alpha=alpha)
+            ax.plot(pts[:, 0], pts[:, 1], color=color, lw=linewidth, alpha=alpha)
@@ -7,11 +7,12 @@ Slab component.
 from MLStructFP.db._c import BaseComponent
 from MLStructFP._types import List, TYPE_CHECKING, NumberType
 
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
+import numpy as np
 
 if TYPE_CHECKING:
     from MLStructFP.db._floor import Floor
+    import matplotlib.pyplot as plt
+    import plotly.graph_objects as go
 
 
 class Slab(BaseComponent):
@@ -37,6 +38,8 @@ class Slab(BaseComponent):
         BaseComponent.__init__(self, slab_id, x, y, floor)
         # noinspection PyProtectedMember
         self.floor._slab[slab_id] = self
+        # noinspection PyProtectedMember
+        self.floor._slab_t = None
 
     def svg_path(self, dx: NumberType = 0, dy: NumberType = 0) -> str:
         """
@@ -46,15 +49,8 @@ class Slab(BaseComponent):
         :param dx: X displacement
         :param dy: Y displacement
         """
-        px, py = [p.x for p in self.points], [p.y for p in self.points]
-        for i in range(len(px)):  # Adds displacement (dx, dy)
-            px[i] += dx
-            py[i] += dy
-        svg = f'M {px[0]},{py[0]}'
-        for i in range(1, len(px)):
-            svg += f' L{px[i]},{py[i]}'
-        svg += ' Z'
-        return svg
+        px, py = [p.x + dx for p in self.points], [p.y + dy for p in self.points]
+        return f'M {px[0]},{py[0]}' + ''.join(f' L{x},{y}' for x, y in zip(px[1:], py[1:])) + ' Z'
 
     # noinspection PyUnusedLocal
     def plot_plotly(
@@ -103,7 +99,6 @@ class Slab(BaseComponent):
         :param linewidth: Plot linewidth
         :param alpha: Alpha transparency value (0-1)
         """
-        px, py = [p.x for p in self.points], [p.y for p in self.points]
-        px.append(px[0])
-        py.append(py[0])
-        ax.plot(px, py, '-', color='#666666', linewidth=linewidth, alpha=alpha)
+        pts = self.get_polygon()
+        pts = np.concatenate((pts, pts[:1]))  # Closes the polygon
+        ax.plot(pts[:, 0], pts[:, 1], '-', color='#666666', linewidth=linewidth, alpha=alpha)
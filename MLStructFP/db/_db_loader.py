@@ -6,17 +6,27 @@ Loads a given dataset .json file.
 
 __all__ = ['DbLoader']
 
+from MLStructFP import __version__
 from MLStructFP.db._floor import Floor
 from MLStructFP.db._c_rect import Rect
 from MLStructFP.db._c_slab import Slab
-from MLStructFP._types import Tuple
+from MLStructFP._types import Any, Tuple
 
+import hashlib
 import json
+import numpy as np
 import os
+import pickle
 
 from pathlib import Path
 from typing import Dict
 
+try:  # orjson is optional (pip install MLStructFP[orjson]), it parses the dataset faster than json
+    # noinspection PyPackageRequirements
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 
 class DbLoader(object):
     """
@@ -25,52 +35,102 @@ class DbLoader(object):
     _path: str
     floor: Dict[int, 'Floor']
 
-    def __init__(self, db: str) -> None:
+    def __init__(self, db: str, cache_path: str = '') -> None:
         """
         Loads a dataset file.
 
+        The disk cache stores the floors with pickle, and loading a pickle file can execute arbitrary code. Thus, the
+        cache folder must only be writable by trusted users.
+
         :param db: Dataset path
+        :param cache_path: Folder to store the loaded floors between runs. If empty, disable the disk cache
         """
         assert os.path.isfile(db), f'Dataset file {db} not found'
-        self._path = str(Path(os.path.realpath(db)).parent)
+        self._path = str(Path(db).resolve().parent)
         self.floor = {}
 
-        with open(db, 'r', encoding='utf8') as dbfile:
-            data = json.load(dbfile)
-
-            # Assemble objects
-            for f_id in data['floor']:
-                f_data = data['floor'][f_id]
-                self.floor[int(f_id)] = Floor(
-                    floor_id=int(f_id),
-                    image_path=os.path.join(self._path, f_data['image']),
-                    image_scale=f_data['scale']
-                )
-            for rect_id in data['rect']:
-                rect_data = data['rect'][rect_id]
-                rect_a = rect_data['angle']
-                Rect(
-                    rect_id=int(rect_id),
-                    wall_id=rect_data['wallID'],
-                    floor=self.floor[rect_data['floorID']],
-                    angle=rect_a if not isinstance(rect_a, list) else rect_a[0],
-                    length=rect_data['length'],
-                    thickness=rect_data['thickness'],
-                    x=rect_data['x'],
-                    y=rect_data['y'],
-                    line_m=rect_data['line'][0],  # Slope
-                    line_n=rect_data['line'][1],  # Intercept
-                    line_theta=rect_data['line'][2]  # Theta
-                )
-            for slab_id in data['slab']:
-                slab_data = data['slab'][slab_id]
-                Slab(
-                    slab_id=int(slab_id),
-                    floor=self.floor[slab_data['floorID']],
-                    x=slab_data['x'],
-                    y=slab_data['y']
-                )
+        # Load the floors from the disk cache, which is invalidated if the dataset or the library version change
+        cache_file = ''
+        if cache_path != '':
+            os.makedirs(cache_path, exist_ok=True)
+            st = os.stat(db)
+            cache_prefix = f'{os.path.basename(db)}_{hashlib.sha1(self._path.encode()).hexdigest()[:12]}_'
+            cache_file = os.path.join(cache_path, f'{cache_prefix}{__version__}_{st.st_mtime_ns}_{st.st_size}.pkl')
+        if cache_file != '' and os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as fp:
+                path, floors = pickle.load(fp)
+            if path == self._path:  # Image paths are absolute, thus, the dataset must be in the same folder
+                self.floor = floors
+                return
+
+        if _orjson is not None:
+            with open(db, 'rb') as dbfile:
+                self._assemble(_orjson.loads(dbfile.read()))
+        else:
+            with open(db, 'r', encoding='utf8') as dbfile:
+                self._assemble(json.load(dbfile))
+        if cache_file != '':
+            with open(cache_file + '.tmp', 'wb') as fp:
+                pickle.dump((self._path, self.floor), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_file + '.tmp', cache_file)  # Partial files are never loaded
+
+            # Remove the stale files of this dataset, left by older dataset or library versions
+            for f in os.listdir(cache_path):
+                # noinspection PyUnboundLocalVariable
+                if f.startswith(cache_prefix) and f.endswith('.pkl') and f != os.path.basename(cache_file):
+                    os.remove(os.path.join(cache_path, f))
+
+    def _assemble(self, data: Dict[str, Any]) -> None:
+        """
+        Create the dataset objects.
+
+        :param data: Parsed dataset file
+        """
+        for f_id in data['floor']:
+            f_data = data['floor'][f_id]
+            self.floor[int(f_id)] = Floor(
+                floor_id=int(f_id),
+                image_path=os.path.join(self._path, f_data['image']),
+                image_scale=f_data['scale']
+            )
+        for rect_id in data['rect']:
+            rect_data = data['rect'][rect_id]
+            rect_a = rect_data['angle']
+            Rect(
+                rect_id=int(rect_id),
+                wall_id=rect_data['wallID'],
+                floor=self.floor[rect_data['floorID']],
+                angle=rect_a if not isinstance(rect_a, list) else rect_a[0],
+                length=rect_data['length'],
+                thickness=rect_data['thickness'],
+                x=rect_data['x'],
+                y=rect_data['y'],
+                line_m=rect_data['line'][0],  # Slope
+                line_n=rect_data['line'][1],  # Intercept
+                line_theta=rect_data['line'][2]  # Theta
+            )
+        for slab_id in data['slab']:
+            slab_data = data['slab'][slab_id]
+            Slab(
+                slab_id=int(slab_id),
+                floor=self.floor[slab_data['floorID']],
+                x=slab_data['x'],
+                y=slab_data['y']
+            )
 
     @property
     def floors(self) -> Tuple['Floor']:
         return tuple(self.floor.values())
+
+    def get_rect_polygons(self) -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Get the corners of all the rects of the dataset, in the order of the floors and of their rects. The corners
+        are read from the cached arrays of each floor, thus, they include the floor mutations.
+
+        :return: Array of rect corners with shape (n, 4, 2), and the floor ID of each rect
+        """
+        polygons = [f.get_rect_polygons() for f in self.floors]
+        floor_ids = [np.full(len(p), f.id, dtype=np.int32) for f, p in zip(self.floors, polygons)]
+        if len(polygons) == 0:
+            return np.empty((0, 4, 2), dtype=np.float64), np.empty(0, dtype=np.int32)
+        return np.concatenate(polygons), np.concatenate(floor_ids)
@@ -6,17 +6,40 @@ Floor component, container of slabs and rectangles.
 
 __all__ = ['Floor']
 
-from MLStructFP.utils import GeomPoint2D, BoundingBox
+from MLStructFP.utils import BoundingBox
 from MLStructFP._types import Dict, Tuple, Optional, TYPE_CHECKING, NumberType, NumberInstance
 
+import functools
 import math
+import numpy as np
 import os
-import plotly.graph_objects as go
 
 if TYPE_CHECKING:
     from MLStructFP.db._c import BaseComponent
     from MLStructFP.db._c_rect import Rect
     from MLStructFP.db._c_slab import Slab
+    import plotly.graph_objects as go
+
+
+@functools.lru_cache(maxsize=64)
+def _mutation_matrix(angle: NumberType, sx: NumberType, sy: NumberType, scale_first: bool) -> 'np.ndarray':
+    """
+    Returns the 2x2 matrix that rotates (around the origin) and scales a point. Matrices are cached, as augmentation
+    pipelines repeat the same mutations, thus, the returned array is read-only.
+
+    :param angle: Angle in degrees
+    :param sx: Scale on x-axis
+    :param sy: Scale on y-axis
+    :param scale_first: Scale first, then rotate
+    :return: Mutation matrix
+    """
+    a = math.radians(angle)
+    s, c = math.sin(a), math.cos(a)
+    rot = np.array([[c, -s], [s, c]])
+    scale = np.diag([float(sx), float(sy)])
+    mat = rot @ scale if scale_first else scale @ rot
+    mat.flags.writeable = False
+    return mat
 
 
 class Floor(object):
@@ -25,8 +48,12 @@ class Floor(object):
     """
     _bb: Optional['BoundingBox']
     _last_mutation: Optional[Dict[str, float]]
+    _last_mutation_matrix: Optional['np.ndarray']
     _rect: Dict[int, 'Rect']  # id => rect
+    _rect_t: Optional[Tuple['Rect', ...]]  # Cached rect tuple, reset when a rect is added
+    _rect_xy: Optional['np.ndarray']  # Cached rect corners, reset when a rect is added
     _slab: Dict[int, 'Slab']  # id => slab
+    _slab_t: Optional[Tuple['Slab', ...]]  # Cached slab tuple, reset when a slab is added
     id: int
     image_path: str
     image_scale: float
@@ -47,30 +74,54 @@ class Floor(object):
         self.image_scale = float(image_scale)
         self._bb = None
         self._last_mutation = None
+        self._last_mutation_matrix = None
         self._rect = {}
+        self._rect_t = None
+        self._rect_xy = None
         self._slab = {}
+        self._slab_t = None
 
     @property
-    def rect(self) -> Tuple['Rect']:
-        return tuple(self._rect.values())
+    def rect(self) -> Tuple['Rect', ...]:
+        if self._rect_t is None:
+            self._rect_t = tuple(self._rect.values())
+            self._rect_xy = None
+        return self._rect_t
+
+    def get_rect_polygons(self) -> 'np.ndarray':
+        """
+        :return: Read-only (n, 4, 2) array with the corners of all the rects, in the same order as the rect tuple
+        """
+        rects = self.rect
+        if self._rect_xy is None:
+            if len(rects) == 0:
+                self._rect_xy = np.empty((0, 4, 2), dtype=np.float64)
+            else:
+                self._rect_xy = np.stack([r.get_polygon() for r in rects])
+            self._rect_xy.flags.writeable = False
+        return self._rect_xy
 
     @property
-    def slab(self) -> Tuple['Slab']:
-        return tuple(self._slab.values())
+    def slab(self) -> Tuple['Slab', ...]:
+        if self._slab_t is None:
+            self._slab_t = tuple(self._slab.values())
+        return self._slab_t
 
-    def plot_basic(self) -> 'go.Figure':
+    def plot_basic(self, merge_rects: bool = False) -> 'go.Figure':
         """
         Plot basic objects.
 
+        :param merge_rects: Plot all rects within a single trace, faster for floors with many rects
         :return: Go figure object
         """
-        return self.plot_complex(fill=False, use_complex_walls=False)
+        return self.plot_complex(fill=False, merge_rects=merge_rects, use_complex_walls=False)
 
     def plot_complex(
             self,
             fill: bool = True,
             draw_rect: bool = True,
             draw_slab: bool = True,
+            merge_rects: bool = False,
             **kwargs
     ) -> 'go.Figure':
         """
@@ -79,8 +130,10 @@ class Floor(object):
         :param fill: Fill figure
         :param draw_rect: Draw wall rects
         :param draw_slab: Draw slabs
+        :param merge_rects: Plot all rects within a single trace, faster for floors with many rects
         :param kwargs: Optional keyword arguments
         """
+        import plotly.graph_objects as go  # Imported on demand, only used to plot
         fig = go.Figure()
 
         if draw_slab:
@@ -90,7 +143,20 @@ class Floor(object):
                     fill=fill,
                     **kwargs
                 )
-        if draw_rect:
+        if draw_rect and merge_rects:
+            from MLStructFP.db._c_rect import Rect  # Local import, as rects import the floor module
+            Rect.plot_plotly_many(
+                fig=fig,
+                rects=self.rect,
+                dx=kwargs.get('dx', 0),
+                dy=kwargs.get('dy', 0),
+                fill=fill,
+                opacity=kwargs.get('opacity', 1.0),
+                color=kwargs.get('color', ''),
+                show_legend=kwargs.get('show_legend', True),
+                polygons=self.get_rect_polygons()
+            )
+        elif draw_rect:
             for r in self.rect:
                 r.plot_plotly(
                     fig=fig,
@@ -99,28 +165,31 @@ class Floor(object):
                 )
 
         grid_color = kwargs.get('plot_gridcolor', '#d7d7d7')
-        fig.update_layout(
+        show_grid = kwargs.get('show_grid', True)
+        fig.update_layout(  # Single update, as each one merges the whole layout
             plot_bgcolor=kwargs.get('plot_bgcolor', '#ffffff'),
             showlegend=kwargs.get('show_legend', True),
             title=f'Floor - ID {self.id}',
             font=dict(
                 size=kwargs.get('font_size', 14),
             ),
-            yaxis_zeroline=False,
-            xaxis_zeroline=False,
             xaxis=dict(
-                gridcolor=grid_color
+                gridcolor=grid_color,
+                hoverformat='.3f',
+                showgrid=show_grid,
+                title_text='x (m)',
+                zeroline=False
             ),
             yaxis=dict(
                 gridcolor=grid_color,
+                hoverformat='.3f',
                 scaleanchor='x',
-                scaleratio=1
+                scaleratio=1,
+                showgrid=show_grid,
+                title_text='y (m)',
+                zeroline=False
             )
         )
-        show_grid = kwargs.get('show_grid', True)
-        fig.update_layout(xaxis_showgrid=show_grid, yaxis_showgrid=show_grid)
-        fig.update_xaxes(title_text='x (m)', hoverformat='.3f')
-        fig.update_yaxes(title_text='y (m)', hoverformat='.3f')
         return fig
 
     def mutate(self, angle: NumberType = 0, sx: NumberType = 1, sy: NumberType = 1,
@@ -138,32 +207,52 @@ class Floor(object):
         assert isinstance(sx, NumberInstance) and sx != 0
         assert isinstance(sy, NumberInstance) and sy != 0
 
-        # Undo last mutation
-        if self._last_mutation is not None:
-            _angle, _sx, _sy = self.mutator_angle, self.mutator_scale_x, self.mutator_scale_y
-            self._last_mutation = None  # Reset mutation
-            self.mutate(-_angle, 1 / _sx, 1 / _sy, scale_first=False)  # Reverse operation
+        # Compose the undo of the last mutation with the new one, so points are visited once
+        new_mat = _mutation_matrix(angle, sx, sy, scale_first)
+        mat = new_mat
+        if self._last_mutation_matrix is not None:
+            mat = new_mat @ np.linalg.inv(self._last_mutation_matrix)
+        (m00, m01), (m10, m11) = mat.tolist()
 
-        # Apply mutation
-        rotation_center = GeomPoint2D()
+        # Apply mutation. If the composed mutation is the identity, points and cached geometry are kept
+        identity = m00 == 1 and m01 == 0 and m10 == 0 and m11 == 1
+        scale_only = m01 == 0 and m10 == 0
         o: Tuple['BaseComponent']
-        for o in (self.rect, self.slab):
+        for o in ((self.rect, self.slab) if not identity else ()):
             for c in o:
-                for p in c.points:
-                    if not scale_first:
-                        p.rotate(rotation_center, angle)
-                    p.x *= sx
-                    p.y *= sy
-                    if scale_first:
-                        p.rotate(rotation_center, angle)
+                if scale_only:
+                    for p in c.points:
+                        p.x *= m00
+                        p.y *= m11
+                else:
+                    for p in c.points:
+                        x, y = p.x, p.y
+                        p.x = m00 * x + m01 * y
+                        p.y = m10 * x + m11 * y
+                # noinspection PyProtectedMember
+                c._clear_cache()
+
+        # Transform the rect corners array (if computed) with the same operations, instead of rebuilding it
+        if self._rect_xy is not None and not identity:
+            x, y = self._rect_xy[..., 0], self._rect_xy[..., 1]
+            if scale_only:
+                self._rect_xy = np.stack((m00 * x, m11 * y), axis=-1)
+            else:
+                self._rect_xy = np.stack((m00 * x + m01 * y, m10 * x + m11 * y), axis=-1)
+            self._rect_xy.flags.writeable = False
+            for c, pts in zip(self.rect, self._rect_xy):  # Rect polygons are views of the array
+                # noinspection PyProtectedMember
+                c._polygon = pts
 
         # Update mutation
-        self._bb = None
+        if not identity:
+            self._bb = None
         self._last_mutation = {
             'angle': angle,
             'sx': sx,
             'sy': sy
         }
+        self._last_mutation_matrix = new_mat
 
         return self
 
@@ -186,17 +275,12 @@ class Floor(object):
         """
         if self._bb is not None:
             return self._bb
-        xmin = math.inf
-        xmax = -math.inf
-        ymin = math.inf
-        ymax = -math.inf
-        o: Tuple['BaseComponent']
-        for o in (self.rect, self.slab):
-            for c in o:
-                for p in c.points:
-                    xmin = min(xmin, p.x)
-                    xmax = max(xmax, p.x)
-                    ymin = min(ymin, p.y)
-                    ymax = max(ymax, p.y)
-        self._bb = BoundingBox(xmin, xmax, ymin, ymax)
+        c: 'BaseComponent'
+        polygons = [self.get_rect_polygons().reshape(-1, 2)] + [c.get_polygon() for c in self.slab]
+        polygons = [pts for pts in polygons if len(pts) > 0]
+        if len(polygons) == 0:
+            self._bb = BoundingBox(math.inf, -math.inf, math.inf, -math.inf)
+        else:
+            pts = np.concatenate(polygons)
+            self._bb = BoundingBox.from_points_array(pts[:, 0], pts[:, 1])
         return self._bb
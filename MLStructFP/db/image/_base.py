@@ -9,9 +9,13 @@ __all__ = [
     'TYPE_IMAGE'
 ]
 
-from MLStructFP._types import TYPE_CHECKING, List, NumberType, Optional, Tuple
+from MLStructFP._types import TYPE_CHECKING, Dict, List, NumberType, Optional, Tuple
 from MLStructFP.utils import make_dirs
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import csv
+import cv2
 import math
 import numpy as np
 import os
@@ -20,7 +24,10 @@ if TYPE_CHECKING:
     from MLStructFP.db._c_rect import Rect
     from MLStructFP.db._floor import Floor
 
+MAX_PENDING_WRITES = 256  # Number of image files queued before waiting for the writers
+PNG_COMPRESSION = 1  # Faster encoding, larger files
 TYPE_IMAGE = 'uint8'
+WRITE_WORKERS = 4
 
 
 class BaseImage(object):
@@ -28,8 +35,12 @@ class BaseImage(object):
     Base dataset image object.
     """
     _image_size: int
-    _images: List['np.ndarray']
+    _images: 'np.ndarray'  # Stored images, only the first _num_images are valid
+    _io_futures: List['Future']
+    _io_pool: Optional['ThreadPoolExecutor']
+    _name_index: Dict[str, int]  # Index of the first image of each name
     _names: List[str]
+    _num_images: int
     _path: str
     _save_images: bool
     save: bool
@@ -50,8 +61,12 @@ class BaseImage(object):
             assert os.path.isdir(path), f'Path <{path}> does not exist'
 
         self._image_size = image_size_px
-        self._images = []
+        self._images = np.empty(0, dtype=TYPE_IMAGE)
+        self._io_futures = []
+        self._io_pool = None
+        self._name_index = {}
         self._names = []  # List of image names
+        self._num_images = 0
         self._path = path
         self._save_images = save_images  # Caution, this can be file expensive
 
@@ -90,18 +105,28 @@ class BaseImage(object):
         :param close: Close after export
         :param compressed: Save compressed file
         """
-        assert len(self._images) > 0, 'Exporter cannot be empty'
+        self._export(filename, self._images[:self._num_images], close, compressed)
+
+    def _export(self, filename: str, data: 'np.ndarray', close: bool, compressed: bool) -> None:
+        """
+        Export images data to numpy format, and the image names to csv.
+
+        :param filename: File to export
+        :param data: Images data
+        :param close: Close after export
+        :param compressed: Save compressed file
+        """
+        assert self._num_images > 0, 'Exporter cannot be empty'
         filename += f'_{self._image_size}'
         make_dirs(filename)
         if compressed:
-            np.savez_compressed(filename, data=self.get_images())  # .npz
+            np.savez_compressed(filename, data=data)  # .npz
         else:
-            np.save(filename, self.get_images())  # .npy
-        imnames = open(filename + '_files.csv', 'w', encoding='utf-8')
-        imnames.write('ID,File\n')
-        for i in range(len(self._names)):
-            imnames.write(f'{i},{self._names[i]}\n')
-        imnames.close()
+            np.save(filename, data, allow_pickle=False)  # .npy
+        with open(filename + '_files.csv', 'w', encoding='utf-8', buffering=1 << 20, newline='') as imnames:
+            writer = csv.writer(imnames, lineterminator='\n')
+            writer.writerow(('ID', 'File'))
+            writer.writerows(enumerate(self._names))
         if close:
             self.close()
 
@@ -111,11 +136,78 @@ class BaseImage(object):
         """
         raise NotImplementedError()
 
+    def _new_image(self, shape: Tuple[int, ...], name: str) -> Tuple[int, 'np.ndarray']:
+        """
+        Reserve the storage of a new image.
+
+        :param shape: Image shape
+        :param name: Image name
+        :return: Index of the image, and the image array to be written
+        """
+        n = self._num_images
+        if n == len(self._images):  # Grow the buffer, thus, appending is amortized O(1)
+            images = np.empty((max(8, 2 * n),) + shape, dtype=TYPE_IMAGE)
+            if n > 0:
+                images[:n] = self._images[:n]
+            self._images = images
+        self._name_index.setdefault(name, n)
+        self._names.append(name)
+        self._num_images += 1
+        return n, self._images[n]
+
+    def _store_image(self, image: 'np.ndarray', name: str) -> int:
+        """
+        Store an image and its name.
+
+        :param image: Image
+        :param name: Image name
+        :return: Index of the image
+        """
+        n, stored = self._new_image(image.shape, name)
+        stored[...] = image
+        return n
+
+    def _clear_images(self) -> None:
+        """
+        Remove all stored images and names.
+        """
+        self._images = np.empty(0, dtype=TYPE_IMAGE)
+        self._name_index.clear()
+        self._names.clear()
+        self._num_images = 0
+
+    def _write_image(self, filename: str, image: 'np.ndarray') -> None:
+        """
+        Write an image file in the background. Files are flushed on close.
+
+        :param filename: File to write
+        :param image: Image, it must not be modified after this call
+        """
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=WRITE_WORKERS)
+        if len(self._io_futures) >= MAX_PENDING_WRITES:
+            self._flush_images()
+        self._io_futures.append(self._io_pool.submit(
+            cv2.imwrite, filename, image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]))
+
+    def _flush_images(self, shutdown: bool = False) -> None:
+        """
+        Wait until all image files are written.
+
+        :param shutdown: Stop the writer threads
+        """
+        for f in self._io_futures:
+            f.result()
+        self._io_futures.clear()
+        if shutdown and self._io_pool is not None:
+            self._io_pool.shutdown()
+            self._io_pool = None
+
     def get_images(self) -> 'np.ndarray':
         """
-        :return: Images as numpy ndarray
+        :return: Copy of the images as numpy ndarray
         """
-        return np.array(self._images, dtype=TYPE_IMAGE)
+        return self._images[:self._num_images].copy()
 
     def get_file_id(self, filename) -> int:
         """
@@ -124,6 +216,6 @@ class BaseImage(object):
         :param filename: Name of the file
         :return: Index on saved list
         """
-        if filename not in self._names:
+        if filename not in self._name_index:
             raise ValueError(f'File <{filename}> have not been processed yet')
-        return self._names.index(filename)
+        return self._name_index[filename]
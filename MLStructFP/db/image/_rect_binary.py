@@ -8,42 +8,124 @@ __all__ = ['RectBinaryImage']
 
 from MLStructFP.db.image._base import BaseImage, TYPE_IMAGE
 from MLStructFP.utils import make_dirs
-from MLStructFP._types import TYPE_CHECKING, Tuple, Dict, Optional, NumberType
+from MLStructFP._types import TYPE_CHECKING, Any, Tuple, List, Optional, NumberType, Union
 
-from PIL import Image
-import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
 import math
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-# import matplotlib as mpl
-# mpl.rcParams['savefig.pad_inches'] = 0
-
 if TYPE_CHECKING:
     from MLStructFP.db._c_rect import Rect
     from MLStructFP.db._floor import Floor
     from MLStructFP.utils import GeomPoint2D
-    from matplotlib.figure import Figure
 
-HIGHLIGHT_RECT = False
-HIGHLIGHT_RECT_COLOR = '#FF0000'
+CANVAS_PAD_PX = 2  # Margin of the floor canvas, it keeps the pixels touched by the walls within the canvas
+MAX_CANVAS_PX = 1 << 26  # Maximum number of pixels of a floor canvas, larger regions are rasterized directly
 MAX_STORED_FLOORS = 2
-RECT_COLOR = '#000000'
+POLYGON_SHIFT = 4  # Number of fractional bits of the polygon vertices given to cv2.fillConvexPoly
+SCALE_DIGITS = 9  # Significant digits of the scale, regions with the same rounded scale share the floor canvas
+
+_BIT_COUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)  # Number of set bits of each byte
+
+# Images were rendered by matplotlib on a 480px axes with 10px of padding, resized to image_size + 2 * crop_px, and then
+# cropped by crop_px on each side. These keep the same framing of the region, thus, datasets remain comparable
+RENDER_AXES_PX = 480
+RENDER_PAD_PX = 10
+
+
+def _round_scale(k: float) -> float:
+    """
+    Round a scale to SCALE_DIGITS significant digits. The scale of each region carries float noise from its position,
+    thus, it is rounded before it is used to rasterize the floor.
+
+    :param k: Pixels per meter
+    :return: Rounded pixels per meter
+    """
+    return float(f'{k:.{SCALE_DIGITS}g}')
+
+
+def _map_polygons(polygons: 'np.ndarray', x0: float, y0: float, kx: float, ky: float) -> 'np.ndarray':
+    """
+    Map polygons to a pixel grid (y-axis points down), pixel centers lie at the integer coordinates.
+
+    :param polygons: Array of polygon vertices (x, y) in meters, shape (n, k, 2)
+    :param x0: Position of the left edge of the grid (m)
+    :param y0: Position of the top edge of the grid (m)
+    :param kx: Pixels per meter on x-axis
+    :param ky: Pixels per meter on y-axis
+    :return: Vertices (px) with POLYGON_SHIFT fractional bits, shape (n, k, 2)
+    """
+    return np.round(((polygons - (x0, y0)) * (kx, -ky) - 0.5) * (1 << POLYGON_SHIFT)).astype(np.int32)
+
+
+def _paste(image: 'np.ndarray', patch: 'np.ndarray', x: int, y: int) -> None:
+    """
+    Merge a patch into an image (bitwise or), the parts outside the image are discarded.
+
+    :param image: Target image
+    :param patch: Patch image
+    :param x: Image column of the left edge of the patch (px)
+    :param y: Image row of the top edge of the patch (px)
+    """
+    h, w = patch.shape
+    ix0, iy0 = max(x, 0), max(y, 0)
+    ix1, iy1 = min(x + w, image.shape[1]), min(y + h, image.shape[0])
+    if ix0 < ix1 and iy0 < iy1:
+        image[iy0:iy1, ix0:ix1] |= patch[iy0 - y:iy1 - y, ix0 - x:ix1 - x]
+
 
-assert HIGHLIGHT_RECT_COLOR != HIGHLIGHT_RECT, 'Highlight color must be different'
-INITIAL_BACKEND = matplotlib.get_backend()
+def _fill_polygons(vertices: 'np.ndarray', ox: int, oy: int, width: int, height: int) -> 'np.ndarray':
+    """
+    Rasterize convex polygons into a new binary image. Each polygon is filled within its own patch, thus, overlapping
+    polygons are merged, and the pixels of a polygon do not depend on the bounds of the image.
+
+    :param vertices: Polygon vertices from _map_polygons, shape (n, k, 2)
+    :param ox: Grid column of the left edge of the image (px)
+    :param oy: Grid row of the top edge of the image (px)
+    :param width: Image width (px)
+    :param height: Image height (px)
+    :return: Image with walls as 1 and background as 0
+    """
+    image = np.zeros((height, width), dtype=TYPE_IMAGE)
+    if len(vertices) == 0:
+        return image
+    lo = (vertices.min(axis=1) >> POLYGON_SHIFT) - 1 - (ox, oy)  # Patch bounds within the image
+    hi = (vertices.max(axis=1) >> POLYGON_SHIFT) + 2 - (ox, oy)
+    visible = np.all(hi > 0, axis=1) & (lo[:, 0] < width) & (lo[:, 1] < height)
+    for pol, (x0, y0), (x1, y1) in zip(vertices[visible], lo[visible].tolist(), hi[visible].tolist()):
+        patch = np.zeros((y1 - y0, x1 - x0), dtype=TYPE_IMAGE)
+        pol = (pol - ((x0 + ox) << POLYGON_SHIFT, (y0 + oy) << POLYGON_SHIFT)).astype(np.int32)
+        cv2.fillConvexPoly(patch, pol, 1, lineType=cv2.LINE_8, shift=POLYGON_SHIFT)
+        _paste(image, patch, x0, y0)
+    return image
+
+
+def _crop_canvas(canvas: 'np.ndarray', ox: int, oy: int, size: int) -> 'np.ndarray':
+    """
+    Crop a region from a rasterized floor.
+
+    :param canvas: Floor canvas
+    :param ox: Grid column of the left edge of the region (px)
+    :param oy: Grid row of the top edge of the region (px)
+    :param size: Image size (px)
+    :return: Image with walls as 1 and background as 0
+    """
+    image = np.zeros((size, size), dtype=TYPE_IMAGE)
+    _paste(image, canvas, -ox, -oy)
+    return image
 
 
 class RectBinaryImage(BaseImage):
     """
-    Rect binary image.
+    Rect binary image. Images are stored with 1 bit per pixel, packed along the rows.
     """
     _crop_px: int
-    _initial_backend: str
     _initialized: bool
-    _plot: Dict[str, Tuple['Figure', 'plt.Axes']]
+    _plot: 'OrderedDict[Tuple[Any, ...], Tuple[Optional[np.ndarray], Optional[np.ndarray], float, float]]'  # Floors
 
     def __init__(
             self,
@@ -61,7 +143,7 @@ class RectBinaryImage(BaseImage):
         BaseImage.__init__(self, path, save_images, image_size_px)
         self._crop_px = int(math.ceil(self._image_size / 32))  # Must be greater or equal than zero
         self._initialized = False
-        self._plot = {}  # Store matplotlib figures
+        self._plot = OrderedDict()  # Store rasterized floors, least recently used first
 
     def init(self) -> 'RectBinaryImage':
         """
@@ -69,52 +151,51 @@ class RectBinaryImage(BaseImage):
 
         :return: Self
         """
-        plt.switch_backend('agg')
         self._initialized = True
         self.close()
         self._initialized = True
         return self
 
-    def _get_floor_plot(self, floor: 'Floor', rect: Optional['Rect'], store: bool) -> Tuple['Figure', 'plt.Axes']:
+    def _get_floor_plot(
+            self,
+            floor: 'Floor',
+            kx: float,
+            ky: float
+    ) -> Tuple[Optional['np.ndarray'], Optional['np.ndarray'], float, float]:
         """
-        Get basic figure of wall rects.
+        Get the rasterized walls of the whole floor at a given resolution. The pixel grid starts CANVAS_PAD_PX pixels
+        before the top-left corner of the floor bounding box, and all the regions are snapped to this grid, thus, a
+        region can move by up to half a pixel.
 
         :param floor: Source floor
-        :param rect: Optional rect
-        :param store: Store cache of the floor
-        :return: Figure of the floor
-        """
-        floor_id = str(floor.id)
-
-        if floor_id in self._plot.keys():
-            return self._plot[floor_id]
-
-        fig: 'Figure'
-        ax: 'plt.Axes'
-        fig = plt.figure(frameon=False)  # Don't configure dpi
-        plt.style.use('default')  # Don't modify this either
-        ax = fig.add_axes([0, 0, 1, 1])
-        ax.axis('off')
-        ax.set_aspect(aspect='equal')
-        ax.grid(False)  # Don't enable as this may destroy the figures
-
-        for r in floor.rect:
-            r.plot_matplotlib(
-                ax=ax,
-                color=RECT_COLOR if (rect and rect.id != r.id or not HIGHLIGHT_RECT) else HIGHLIGHT_RECT_COLOR
-            )
+        :param kx: Pixels per meter on x-axis, rounded by _round_scale
+        :param ky: Pixels per meter on y-axis, rounded by _round_scale
+        :return: Floor canvas, or the wall vertices (_map_polygons) if the canvas is too large, and the position of the
+            left and top edges of the grid (m)
+        """
+        floor_key = (floor.id, floor.mutator_angle, floor.mutator_scale_x, floor.mutator_scale_y, kx, ky)
+
+        floor_plot = self._plot.get(floor_key)
+        if floor_plot is not None:
+            self._plot.move_to_end(floor_key)
+            return floor_plot
+
+        bb = floor.bounding_box
+        x0, y0 = bb.xmin - CANVAS_PAD_PX / kx, bb.ymax + CANVAS_PAD_PX / ky
+        vertices = _map_polygons(floor.get_rect_polygons(), x0, y0, kx, ky)
+        width = int(math.ceil((bb.xmax - bb.xmin) * kx)) + 2 * CANVAS_PAD_PX + 1
+        height = int(math.ceil((bb.ymax - bb.ymin) * ky)) + 2 * CANVAS_PAD_PX + 1
+        if width * height > MAX_CANVAS_PX:  # Each region is filled from the vertices
+            floor_plot = (None, vertices, x0, y0)
+        else:
+            floor_plot = (_fill_polygons(vertices, 0, 0, width, height), None, x0, y0)
 
         # Save
-        if store:
-            if len(self._plot) >= MAX_STORED_FLOORS:
-                key_iter = iter(self._plot.keys())
-                k1: str = next(key_iter)
-                f1, _ = self._plot[k1]
-                plt.close(f1)  # Close the figure
-                del self._plot[k1]  # Remove
-            self._plot[floor_id] = (fig, ax)
+        if len(self._plot) >= MAX_STORED_FLOORS:
+            self._plot.popitem(last=False)  # Remove the least recently used
+        self._plot[floor_key] = floor_plot
 
-        return fig, ax
+        return floor_plot
 
     def make_rect(self, rect: 'Rect', crop_length: NumberType = 5) -> Tuple[int, 'np.ndarray']:
         """
@@ -133,6 +214,101 @@ class RectBinaryImage(BaseImage):
             floor=rect.floor, rect=rect
         )
 
+    def make_rects(
+            self,
+            rects: List['Rect'],
+            crop_length: NumberType = 5,
+            workers: Optional[int] = None
+    ) -> List[Tuple[int, 'np.ndarray']]:
+        """
+        Generate images for the perimeter of several rectangles. Each floor is rasterized once, and the regions are
+        cropped in parallel.
+
+        :param rects: Rectangles
+        :param crop_length: Size of crop from center of the rect to any edge in meters
+        :param workers: Number of threads. If None, it uses the ThreadPoolExecutor default
+        :return: Returns the image index and matrix of each rect
+        """
+        if not self._initialized:
+            raise RuntimeError('Exporter not initialized, use .init()')
+        s = self._image_size
+        xmin, xmax, ymin, ymax = self._get_viewport(*self._compute_bboxes(rects, crop_length))
+        kx, ky = (s / (xmax - xmin)).tolist(), (s / (ymax - ymin)).tolist()
+        xmin, ymax = xmin.tolist(), ymax.tolist()
+        jobs = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:  # cv2 releases the GIL
+            for i, rect in enumerate(rects):
+                rkx, rky = _round_scale(kx[i]), _round_scale(ky[i])
+                canvas, vertices, x0, y0 = self._get_floor_plot(rect.floor, rkx, rky)
+                ox, oy = int(round((xmin[i] - x0) * rkx)), int(round((y0 - ymax[i]) * rky))
+                if canvas is not None:
+                    jobs.append(pool.submit(_crop_canvas, canvas, ox, oy, s))
+                else:
+                    jobs.append(pool.submit(_fill_polygons, vertices, ox, oy, s, s))
+            images = [job.result() for job in jobs]
+        return [(self._save_region(array, f'{rect.id}'), array) for rect, array in zip(rects, images)]
+
+    @staticmethod
+    def _compute_bboxes(
+            rects: List['Rect'],
+            crop_length: NumberType
+    ) -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray', 'np.ndarray']:
+        """
+        Compute the regions around the mass center of several rects.
+
+        :param rects: Rectangles
+        :param crop_length: Size of crop from center of the rect to any edge in meters
+        :return: Arrays of xmin, xmax, ymin, ymax (m)
+        """
+        centers = np.array([(c.x, c.y) for c in (r.get_mass_center() for r in rects)], dtype=np.float64)
+        centers = centers.reshape(-1, 2)
+        cx, cy = centers[:, 0], centers[:, 1]
+        return cx - crop_length, cx + crop_length, cy - crop_length, cy + crop_length
+
+    def _get_viewport(
+            self,
+            xmin: Union[NumberType, 'np.ndarray'],
+            xmax: Union[NumberType, 'np.ndarray'],
+            ymin: Union[NumberType, 'np.ndarray'],
+            ymax: Union[NumberType, 'np.ndarray']
+    ) -> Tuple[Any, Any, Any, Any]:
+        """
+        Get the plotted viewport of a region, that is, the region without the crop margin. Accepts scalars or arrays
+        of regions.
+
+        :param xmin: Minimum x-axis (m)
+        :param xmax: Maximum x-axis (m)
+        :param ymin: Minimum y-axis (m)
+        :param ymax: Maximum y-axis (m)
+        :return: Viewport xmin, xmax, ymin, ymax (m)
+        """
+        if isinstance(xmin, np.ndarray):
+            xmin, xmax = np.minimum(xmin, xmax), np.maximum(xmin, xmax)
+            ymin, ymax = np.minimum(ymin, ymax), np.maximum(ymin, ymax)
+        else:
+            xmin, xmax = min(xmin, xmax), max(xmin, xmax)
+            ymin, ymax = min(ymin, ymax), max(ymin, ymax)
+        f_crop = self._crop_px / (self._image_size + 2 * self._crop_px)
+        f_crop = (f_crop * (RENDER_AXES_PX + 2 * RENDER_PAD_PX) - RENDER_PAD_PX) / RENDER_AXES_PX
+        pad_x = f_crop * (xmax - xmin)
+        pad_y = f_crop * (ymax - ymin)
+        return xmin + pad_x, xmax - pad_x, ymin + pad_y, ymax - pad_y
+
+    def _save_region(self, array: 'np.ndarray', figname: str) -> int:
+        """
+        Save a region image to file and to the library array.
+
+        :param array: Image
+        :param figname: Image name
+        :return: Image index on the library array
+        """
+        if self._save_images:
+            assert self._path != '', 'Path cannot be empty'
+            filesave = os.path.join(self._path, figname + '.png')
+            make_dirs(filesave)
+            self._write_image(filesave, 255 - 255 * array)  # Black walls over white background
+        return self._store_image(np.packbits(array, axis=-1), figname) if self.save else self._num_images - 1
+
     def make_region(self, xmin: NumberType, xmax: NumberType, ymin: NumberType, ymax: NumberType,
                     floor: 'Floor', rect: Optional['Rect'] = None) -> Tuple[int, 'np.ndarray']:
         """
@@ -148,70 +324,55 @@ class RectBinaryImage(BaseImage):
         """
         if not self._initialized:
             raise RuntimeError('Exporter not initialized, use .init()')
-        store_matplotlib_figure = not HIGHLIGHT_RECT
-        fig, ax = self._get_floor_plot(floor, rect, store=store_matplotlib_figure)
-
-        # Set the current figure
-        # noinspection PyUnresolvedReferences
-        plt.figure(fig.number)
-
-        # Save the figure
         figname = f'{rect.id}' if rect else f'{floor.id}-x-{xmin:.2f}-{xmax:.2f}-y-{ymin:.2f}-{ymax:.2f}'
 
-        ax.set_xlim(min(xmin, xmax), max(xmin, xmax))
-        ax.set_ylim(min(ymin, ymax), max(ymin, ymax))
-
-        # Convert
-        ram = io.BytesIO()
-        plt.savefig(ram, format='png', dpi=100, bbox_inches='tight', transparent=False)
-        ram.seek(0)
-        im: 'Image.Image' = Image.open(ram)
-
-        im2: 'Image.Image' = im.convert('RGB').convert('P', palette=Image.ADAPTIVE)
-        # im2 = im.convert('RGB')  # Produces larger files
-        # im2 = im.convert('1')
-
-        # Resize
-        s_resize = self._image_size + 2 * self._crop_px
-        im3: 'Image.Image' = im2.resize((s_resize, s_resize))
-
-        # Crop
-        s_crop = self._image_size + self._crop_px
-        im4: 'Image.Image' = im3.crop((self._crop_px, self._crop_px, s_crop, s_crop))
+        # The crop margin is removed from the viewport
+        xmin, xmax, ymin, ymax = self._get_viewport(xmin, xmax, ymin, ymax)
 
-        # Save to file
-        if self._save_images:
-            assert self._path != '', 'Path cannot be empty'
-            filesave = os.path.join(self._path, figname + '.png')
-            make_dirs(filesave)
-            im4.save(filesave, format='PNG')
-            # print('Rect {0} saved to {1}'.format(rect.id, filesave))
+        # Crop the region from the rasterized floor, walls are 1 and background is 0
+        s = self._image_size
+        kx = _round_scale(s / (xmax - xmin))
+        ky = _round_scale(s / (ymax - ymin))
+        canvas, vertices, x0, y0 = self._get_floor_plot(floor, kx, ky)
+        ox, oy = int(round((xmin - x0) * kx)), int(round((y0 - ymax) * ky))
+        if canvas is not None:
+            array = _crop_canvas(canvas, ox, oy, s)
+        else:
+            array = _fill_polygons(vertices, ox, oy, s, s)
 
-        # noinspection PyTypeChecker
-        array = np.array(im4, dtype=TYPE_IMAGE)
+        # Returns the image index on the library array
+        return self._save_region(array, figname), array
 
-        # Save to array
-        if self.save:
-            # array = np.where(array > 0, 0, 1)
-            self._images.append(array)
-            # self._images.append(array)
-            self._names.append(figname)
+    def export(self, filename: str, close: bool = True, compressed: bool = True, packbits: bool = False) -> None:
+        """
+        Export saved images to numpy format and remove all data.
 
-        # Close data
-        ram.close()
-        im.close()
-        im2.close()
-        im3.close()
-        im4.close()
+        :param filename: File to export
+        :param close: Close after export
+        :param compressed: Save compressed file
+        :param packbits: Store 1 bit per pixel, images are restored with np.unpackbits(data, axis=-1, count=image_size)
+        """
+        data = self._images[:self._num_images] if packbits else self.get_images()
+        self._export(filename, data, close, compressed)
 
-        if not store_matplotlib_figure:
-            plt.close(fig)
+    def get_images(self) -> 'np.ndarray':
+        """
+        :return: Images as numpy ndarray
+        """
+        s = self._image_size
+        if self._num_images == 0:
+            return np.empty((0, s, s), dtype=TYPE_IMAGE)
+        return np.unpackbits(self._images[:self._num_images], axis=-1, count=s)
 
-        # Remove data
-        del im, im2, im3, im4, fig, ax
+    def count_pixels(self, index: int) -> int:
+        """
+        Count the wall pixels of a stored image, same as np.sum(get_images()[index]) but without unpacking the images.
 
-        # Returns the image index on the library array
-        return len(self._images) - 1, array
+        :param index: Image index
+        :return: Number of pixels with value 1
+        """
+        assert 0 <= index < self._num_images, f'Image index {index} out of range'
+        return int(_BIT_COUNT[self._images[index]].sum(dtype=np.int64))  # Padding bits are always 0
 
     def close(self) -> None:
         """
@@ -220,22 +381,15 @@ class RectBinaryImage(BaseImage):
         if not self._initialized:
             raise RuntimeError('Exporter not initialized, it cannot be closed')
 
-        # Close figures
-        for f in self._plot.keys():
-            fig, _ = self._plot[f]
-            plt.close(fig)
-
         # Remove
+        self._flush_images(shutdown=True)
         self._plot.clear()
-        self._images.clear()
-        self._names.clear()
+        self._clear_images()
 
         self._initialized = False
 
     @staticmethod
     def restore_plot() -> None:
         """
-        Restore plot backend.
+        Restore plot backend. Images are rasterized without matplotlib, thus, the backend is never changed.
         """
-        if plt.get_backend() == 'agg':
-            plt.switch_backend(INITIAL_BACKEND)
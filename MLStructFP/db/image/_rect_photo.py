@@ -6,12 +6,16 @@ Image of the true rect photo from the base image plan.
 
 __all__ = ['RectFloorPhoto']
 
+from MLStructFP import __version__
 from MLStructFP.db.image._base import BaseImage, TYPE_IMAGE
 from MLStructFP.utils import GeomPoint2D
-from MLStructFP._types import TYPE_CHECKING, Dict, List, Union, Tuple, Optional, NumberType
+from MLStructFP._types import TYPE_CHECKING, Any, Dict, List, Union, Tuple, Optional, NumberType
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import cv2
-import gc
+import hashlib
 import math
 import numpy as np
 import os
@@ -20,8 +24,13 @@ if TYPE_CHECKING:
     from MLStructFP.db._c_rect import Rect
     from MLStructFP.db._floor import Floor
 
-IMAGES_TO_CLEAR_MEMORY = 10000
-MAX_STORED_FLOORS = 2
+IMREAD_REDUCED_COLOR = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+MAX_STORED_FLOORS = int(os.environ.get('MLSTRUCTFP_MAX_STORED_FLOORS', 8))  # Processed floor images kept in memory
 
 
 def _im_show(title: str, img: 'np.ndarray') -> None:
@@ -71,65 +80,18 @@ def _show_img(
     cv2.destroyAllWindows()
 
 
-def _sgn(x) -> float:
-    """
-    Returns the sign of x.
-
-    :param x: Number
-    :return: Sign
-    """
-    if x < 0:
-        return -1
-    elif x == 0:
-        return 0
-    else:
-        return 1
-
-
-def _swap_colors(image: 'np.ndarray', cfrom: int, cto: int, tol: float = 1e-3):
+def _fill_transparent(image: 'np.ndarray', color: int) -> 'np.ndarray':
     """
-    Swap colors from image.
+    Convert a BGRA image to BGR, replacing the transparent pixels with a given color.
 
-    :param image: Target image
-    :param cfrom: Color from
-    :param cto: Color to
-    :param tol: Tolerance
+    :param image: BGRA image
+    :param color: Color of the transparent pixels
+    :return: BGR image
     """
-    assert 0 <= cfrom <= 255
-    assert 0 <= cto <= 255
-    if cfrom == cto:
-        return
-
-    ccof = (cfrom, cfrom, cfrom)
-    ccol = (cto, cto, cto)
-
-    def _make_range(color) -> tuple:
-        """
-        Create color range from to.
-
-        :param color: Target color
-        :return: Range color
-        """
-        e = tol
-        if color == 0:
-            return (0, 0, 0), (color + e, color + e, color + e)
-        elif abs(color - e) <= 255:
-            return (color - e, color - e, color - e), (color, color, color)
-        else:
-            return (color, color, color), (color + e, color + e, color + e)
-
-    # Create mask to change black to export color
-    bc = _make_range(cfrom)
-    mask_b_c = cv2.inRange(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), bc[0], bc[1])
-
-    # Color to black
-    cb = _make_range(cto)
-    mask_c_b = cv2.inRange(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), cb[0], cb[1])
-    # _show_img([mask_b_c, mask_c_b])
-
-    # Replace color from mask
-    image[mask_b_c == 255] = ccol
-    image[mask_c_b == 255] = ccof
+    mask = cv2.compare(image[:, :, 3], 0, cv2.CMP_EQ)
+    pixels = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    cv2.copyTo(np.full_like(pixels, color), mask, pixels)  # Masked copy, faster than boolean indexing
+    return pixels
 
 
 def _rotate_image(image: 'np.ndarray', angle: float, bound: bool = True) -> 'np.ndarray':
@@ -160,13 +122,29 @@ def _rotate_image_bound(mat: 'np.ndarray', angle: float) -> 'np.ndarray':
     :param angle: Rotation angle
     :return: Rotated image
     """
+    rotation_mat, bound_w, bound_h = _get_rotation_bound(mat.shape[0], mat.shape[1], angle)
+
+    # rotate image with the new bounds and translated rotation matrix
+    rotated_mat = cv2.warpAffine(mat, rotation_mat, (bound_w, bound_h))
+    return rotated_mat
+
 
-    height, width = mat.shape[:2]  # image shape has 3 dimensions
+def _get_rotation_bound(height: int, width: int, angle: float) -> Tuple['np.ndarray', int, int]:
+    """
+    Rotation matrix of an image (angle in degrees), expanded to avoid cropping.
+
+    :param height: Image height
+    :param width: Image width
+    :param angle: Rotation angle
+    :return: Rotation matrix, and the width and height of the rotated image
+    """
     image_center = (
         width / 2,
         height / 2)  # getRotationMatrix2D needs coordinates in reverse order (width, height) compared to shape
 
     rotation_mat = cv2.getRotationMatrix2D(image_center, angle, 1.)
+    if angle % 90 == 0:  # Right angles are a permutation of the pixels, remove the rounding error of sin/cos
+        rotation_mat = np.rint(rotation_mat)
 
     # rotation calculates the cos and sin, taking absolutes of those.
     abs_cos = abs(rotation_mat[0, 0])
@@ -180,9 +158,7 @@ def _rotate_image_bound(mat: 'np.ndarray', angle: float) -> 'np.ndarray':
     rotation_mat[0, 2] += bound_w / 2 - image_center[0]
     rotation_mat[1, 2] += bound_h / 2 - image_center[1]
 
-    # rotate image with the new bounds and translated rotation matrix
-    rotated_mat = cv2.warpAffine(mat, rotation_mat, (bound_w, bound_h))
-    return rotated_mat
+    return rotation_mat, bound_w, bound_h
 
 
 def _show_frame_image(image: 'np.ndarray', x1: int, y1: int, x2: int, y2: int) -> None:
@@ -195,13 +171,13 @@ def _show_frame_image(image: 'np.ndarray', x1: int, y1: int, x2: int, y2: int) -
     :param x2: Max x
     :param y2: Max y
     """
-    image = image.copy()
+    image = image.copy()  # The source image is cached
     w = 100
-    color = [255, 255, 255]
-    image[y1:y2, x1:x1 + w] = color
-    image[y1:y2, x2 - w:x2] = color
-    image[y1:y1 + w, x1:x2] = color
-    image[y2 - w:y2, x1:x2] = color
+    color = (255, 255, 255)
+    cv2.rectangle(image, (x1, y1), (x1 + w - 1, y2 - 1), color, thickness=cv2.FILLED)
+    cv2.rectangle(image, (x2 - w, y1), (x2 - 1, y2 - 1), color, thickness=cv2.FILLED)
+    cv2.rectangle(image, (x1, y1), (x2 - 1, y1 + w - 1), color, thickness=cv2.FILLED)
+    cv2.rectangle(image, (x1, y2 - w), (x2 - 1, y2 - 1), color, thickness=cv2.FILLED)
     _show_img(image, 'Frame')
 
 
@@ -227,22 +203,13 @@ def _show_dot_image(
         :param _y: Y pos
         :param color: Color of the point
         """
-        x1 = int(_x)
-        y1 = int(_y)
         w = 75
-        x1 = int(x1 - w / 2)
-        y1 = int(y1 - w / 2)
-        x2 = x1 + w
-        y2 = y1 + w
-        image[y1:y2, x1:x1 + w] = color
-        image[y1:y2, x2 - w:x2] = color
-        image[y1:y1 + w, x1:x2] = color
-        image[y2 - w:y2, x1:x2] = color
+        x1 = int(int(_x) - w / 2)
+        y1 = int(int(_y) - w / 2)
+        cv2.rectangle(image, (x1, y1), (x1 + w - 1, y1 + w - 1), tuple(color), thickness=cv2.FILLED)
 
     if colors is None:
-        colors = []
-        for i in range(len(points)):
-            colors.append([255, 255, 255])
+        colors = [[255, 255, 255]] * len(points)
     for j in range(len(points)):
         p = points[j]
         if not isinstance(p, tuple):
@@ -252,15 +219,40 @@ def _show_dot_image(
     _show_img(image, 'Frame')
 
 
+def _floor_to_image(params: Tuple[float, ...], x: Any, y: Any) -> Tuple[Any, Any]:
+    """
+    Transform floor coordinates to the processed floor image. Accepts scalars or arrays.
+
+    :param params: Transformation parameters of the floor
+    :param x: X coordinate (m)
+    :param y: Y coordinate (m)
+    :return: Image coordinates (px)
+    """
+    ax, ay, rot_c, rot_s, bx, by, kx, ky, rc2x, rc2y, cos_phi, sin_phi, w2, h2 = params
+
+    # Compute true point based on rotation, and scale to pixels
+    if rot_s != 0:
+        x, y = x * rot_c - y * rot_s, x * rot_s + y * rot_c
+    x = bx + kx * (x * ax)
+    y = by + ky * (y * ay)
+
+    # Rotate around the center of the image, as r*cos(theta + phi) = r*cos(theta)*cos(phi) - r*sin(theta)*sin(phi)
+    # with r*cos(theta) and r*sin(theta) being the distance to the original center
+    ddx, ddy = rc2x - x, rc2y - y
+    return w2 + ddx * cos_phi - ddy * sin_phi, h2 + ddx * sin_phi + ddy * cos_phi
+
+
 class RectFloorPhoto(BaseImage):
     """
     Floor rect photo.
     """
+    _cache_path: str
     _empty_color: int
-    _floor_center_d: Dict[str, 'GeomPoint2D']  # No rotation image size in pixels
-    _floor_images: Dict[str, 'np.ndarray']
+    _floor_images: 'OrderedDict[Tuple[int, float, float], List[np.ndarray]]'  # Not rotated, least recently used first
+    _floor_params: Dict[Tuple[int, float, float], Dict[float, tuple]]  # Transformation and rotation of each angle
     _kernel: 'np.ndarray'
-    _processed_images: int
+    _pyramid_levels: int
+    _reduce_factor: int
     _verbose: bool
 
     def __init__(
@@ -268,7 +260,10 @@ class RectFloorPhoto(BaseImage):
             path: str = '',
             save_images: bool = False,
             image_size_px: int = 64,
-            empty_color: int = -1
+            empty_color: int = -1,
+            cache_path: str = '',
+            reduce_factor: int = 1,
+            pyramid_levels: int = 0
     ) -> None:
         """
         Constructor.
@@ -277,12 +272,23 @@ class RectFloorPhoto(BaseImage):
         :param save_images: Save images on path
         :param image_size_px: Image size (width/height), bigger images are expensive, double the width, quad the size
         :param empty_color: Empty base color. If -1, disable empty replace color
+        :param cache_path: Folder to store the processed floor images between runs. If empty, disable the disk cache
+        :param reduce_factor: Floor images are decoded at 1/1, 1/2, 1/4 or 1/8 of their size. Use only if the crops are
+            larger than the output image by that factor, as the resolution of the crops is reduced
+        :param pyramid_levels: Number of half-size copies of each floor image kept in memory (up to 1/3 more memory).
+            Large crops are taken from the smallest copy that is still twice the output size, which is much faster
         """
         BaseImage.__init__(self, path, save_images, image_size_px)
         assert -1 <= empty_color <= 255
+        assert reduce_factor in IMREAD_REDUCED_COLOR, f'Invalid reduce factor, allowed: {list(IMREAD_REDUCED_COLOR)}'
+        assert pyramid_levels >= 0
 
+        if cache_path != '':
+            os.makedirs(cache_path, exist_ok=True)
+        self._cache_path = cache_path
         self._empty_color = empty_color  # Color to replace empty data
-        self._processed_images = 0
+        self._pyramid_levels = pyramid_levels
+        self._reduce_factor = reduce_factor
         self._verbose = False
 
         # Create filter kernel
@@ -291,23 +297,74 @@ class RectFloorPhoto(BaseImage):
         #                          [0, -1, 0]])
         self._kernel = np.array([[-1, -1, -1],
                                  [-1, 9, -1],
-                                 [-1, -1, -1]])
+                                 [-1, -1, -1]], dtype=np.float32)  # filter2D converts the kernel to float
 
         # Store loaded images
-        self._floor_images = {}
-        self._floor_center_d = {}
+        self._floor_images = OrderedDict()
+        self._floor_params = {}  # Transformation from floor coordinates to image pixels, for each angle
 
-    def _get_floor_image(self, floor: 'Floor') -> Tuple['np.ndarray', 'GeomPoint2D']:
+    def _get_floor_image(self, floor: 'Floor') -> List['np.ndarray']:
         """
         Get floor image numpy class.
 
         :param floor: Floor object
-        :return: Image array
+        :return: Image array pyramid, not rotated. Each level halves the size of the previous one
+        """
+        floor_hash = self._get_floor_hash(floor)
+        cached = self._floor_images.get(floor_hash)
+        if cached is not None:
+            self._floor_images.move_to_end(floor_hash)
+            return cached
+
+        # Load from the disk cache, the image is memory-mapped. Floors of different datasets can share the same ID,
+        # thus, the file is also keyed by the image path. The library version is part of the key, as it may change
+        # the parsed images
+        cache_file = ''
+        if self._cache_path != '':
+            mtime = os.stat(floor.image_path).st_mtime_ns
+            path_hash = hashlib.sha1(os.path.realpath(floor.image_path).encode()).hexdigest()[:12]
+            cache_prefix = f'floor_{floor.id}_{path_hash}_'
+            cache_file = os.path.join(self._cache_path, f'{cache_prefix}{__version__}_{floor.mutator_scale_x}_'
+                                                        f'{floor.mutator_scale_y}_{self._empty_color}_'
+                                                        f'{self._reduce_factor}_{mtime}.npy')
+        if cache_file != '' and os.path.isfile(cache_file):
+            pixels = np.load(cache_file, mmap_mode='r')
+        else:
+            pixels = self._parse_image(floor)
+            if cache_file != '':
+                with open(cache_file + '.tmp', 'wb') as fp:
+                    np.save(fp, pixels)
+                os.replace(cache_file + '.tmp', cache_file)  # Partial files are never loaded
+
+                # Remove the stale files of this floor image, left by older images, scales or library versions
+                for f in os.listdir(self._cache_path):
+                    # noinspection PyUnboundLocalVariable
+                    if f.startswith(cache_prefix) and f.endswith('.npy') and f != os.path.basename(cache_file):
+                        try:
+                            os.remove(os.path.join(self._cache_path, f))
+                        except OSError:  # The file is memory-mapped by other process on Windows
+                            pass
+
+        pyramid = [pixels]
+        for _ in range(self._pyramid_levels):
+            h, w = pyramid[-1].shape[:2]  # Box filter, as the final resize
+            pyramid.append(cv2.resize(pyramid[-1], (w // 2, h // 2), interpolation=cv2.INTER_AREA))
+
+        # Store, removing the least recently used
+        if len(self._floor_images) >= MAX_STORED_FLOORS:
+            k1, _ = self._floor_images.popitem(last=False)
+            self._floor_params.pop(k1, None)
+        self._floor_images[floor_hash] = pyramid
+
+        return pyramid
+
+    def _parse_image(self, floor: 'Floor') -> 'np.ndarray':
         """
-        floor_hash = f'{floor.id}{floor.mutator_angle}{floor.mutator_scale_x}{floor.mutator_scale_y}'
-        if floor_hash in self._floor_images.keys():
-            return self._floor_images[floor_hash], self._floor_center_d[floor_hash]
+        Read the floor image, and apply the floor scale mutators. The rotation is applied while cropping.
 
+        :param floor: Floor object
+        :return: Image array
+        """
         ip = floor.image_path
         if self._verbose:
             print(f'Loading image: {ip}')
@@ -315,58 +372,53 @@ class RectFloorPhoto(BaseImage):
         # Make default empty color
         pixels: 'np.ndarray'
         if self._empty_color >= 0:
-            image = cv2.imread(ip, cv2.IMREAD_UNCHANGED)
-
-            # make mask of where the transparent bits are
-            trans_mask = image[:, :, 3] == 0
-
-            # replace areas of transparency with white and not transparent
-            image[trans_mask] = [self._empty_color, self._empty_color, self._empty_color, 255]
-            pixels = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+            image = self._reduce_image(cv2.imread(ip, cv2.IMREAD_UNCHANGED))  # Reduced decoding drops the alpha
+            if image.ndim == 2:  # Grayscale without transparency, expanded in a single pass
+                pixels = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            elif image.shape[2] == 3:  # No transparency
+                pixels = image
+            else:  # Replace areas of transparency with the empty color
+                pixels = _fill_transparent(image, self._empty_color)
         else:
-            pixels = cv2.imread(ip)
+            pixels = cv2.imread(ip, IMREAD_REDUCED_COLOR[self._reduce_factor])
 
             # Turn all black lines to white
             if np.max(pixels) == 0:
                 image = cv2.imread(ip, cv2.IMREAD_UNCHANGED)
-                trans_mask = image[:, :, 3] == 0
-                image[trans_mask] = [255, 255, 255, 255]  # Turn all black to white to invert
-                pixels = 255 - cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)  # Invert colors
+                if image.shape[:2] != pixels.shape[:2]:
+                    image = cv2.resize(image, (pixels.shape[1], pixels.shape[0]), interpolation=cv2.INTER_AREA)
+                pixels = cv2.bitwise_not(_fill_transparent(image, 255))  # Turn all black to white, and invert
 
-        # Flip image
-        if floor.mutator_scale_x < 0:
-            pixels = cv2.flip(pixels, 1)
-        if floor.mutator_scale_y < 0:
-            pixels = cv2.flip(pixels, 0)
+        scale_x, scale_y = floor.mutator_scale_x, floor.mutator_scale_y
+        if scale_x == 1 and scale_y == 1:  # No mutators
+            return pixels
 
-        # Transform image due to mutators
-        sy, sx, _ = pixels.shape
-        sx = int(math.ceil(abs(sx * floor.mutator_scale_x)))
-        sy = int(math.ceil(abs(sy * floor.mutator_scale_y)))
-        pixels = cv2.resize(pixels, (sx, sy))
+        # Flip image, both axes are flipped within a single pass
+        flip_x, flip_y = scale_x < 0, scale_y < 0
+        if flip_x or flip_y:
+            pixels = cv2.flip(pixels, -1 if flip_x and flip_y else (1 if flip_x else 0))
 
-        source_pixels: 'np.ndarray' = pixels
-        if self._verbose:
-            source_pixels = pixels.copy()
-        cy, cx = pixels.shape[:2]  # Source center pixel
-        pc = GeomPoint2D(cx, cy)
-        pixels = _rotate_image(pixels, floor.mutator_angle)
-        if self._verbose:
-            _show_img([source_pixels, pixels])
+        # Transform image due to mutators
+        h, w = pixels.shape[:2]
+        sx = int(math.ceil(abs(w * scale_x)))
+        sy = int(math.ceil(abs(h * scale_y)))
+        if (sx, sy) != (w, h):
+            pixels = cv2.resize(pixels, (sx, sy))
 
-        # Store
-        self._floor_images[floor_hash] = pixels
-        self._floor_center_d[floor_hash] = pc
-        # print('Storing', self.name, floor_hash)
+        return pixels
 
-        if len(self._floor_images) >= MAX_STORED_FLOORS:
-            key_iter = iter(self._floor_images.keys())
-            k1: str = next(key_iter)
-            del self._floor_images[k1]  # Remove
-            del self._floor_center_d[k1]
-            # print('Removing', self.name, k1)
+    def _reduce_image(self, image: 'np.ndarray') -> 'np.ndarray':
+        """
+        Reduce the image size by the reduce factor.
 
-        return pixels, pc
+        :param image: Image
+        :return: Reduced image
+        """
+        f = self._reduce_factor
+        if f == 1:
+            return image
+        h, w = image.shape[:2]
+        return cv2.resize(image, ((w + f - 1) // f, (h + f - 1) // f), interpolation=cv2.INTER_AREA)
 
     def make_rect(self, rect: 'Rect', crop_length: NumberType = 5) -> Tuple[int, 'np.ndarray']:
         """
@@ -396,6 +448,50 @@ class RectFloorPhoto(BaseImage):
         dy = (ymax - ymin) / 2
         return self._make(floor, GeomPoint2D(xmin + dx, ymin + dy), dx, dy, rect)
 
+    def make_rects(
+            self,
+            rects: List['Rect'],
+            crop_length: NumberType = 5,
+            workers: Optional[int] = None
+    ) -> List[Tuple[int, 'np.ndarray']]:
+        """
+        Generate images for the perimeter of several rectangles. Each floor image is loaded once, while the regions of
+        the previous floor are cropped in parallel.
+
+        :param rects: Rectangles
+        :param crop_length: Size of crop from center of the rect to any edge in meters
+        :param workers: Number of threads. If None, it uses the ThreadPoolExecutor default
+        :return: Returns the image index and matrix of each rect
+        """
+        assert crop_length > 0
+
+        # Group the rects by floor, thus, each floor image is requested once
+        floor_rects: Dict[Tuple[Tuple[int, float, float], float], List[int]] = {}
+        for i in range(len(rects)):
+            floor = rects[i].floor
+            floor_rects.setdefault((self._get_floor_hash(floor), floor.mutator_angle), []).append(i)
+
+        groups = list(floor_rects.values())
+        jobs: List[Optional['Future']] = [None] * len(rects)
+        with ThreadPoolExecutor(max_workers=workers) as pool:  # cv2 releases the GIL
+            # Floors are loaded one at a time, the next one is loaded while the current one is being cropped
+            loading = pool.submit(self._get_floor_transform, rects[groups[0][0]].floor) if len(groups) > 0 else None
+            for g, group in enumerate(groups):
+                images, params, rotation = loading.result()
+                if g + 1 < len(groups):
+                    loading = pool.submit(self._get_floor_transform, rects[groups[g + 1][0]].floor)
+                ax, ay = params[0], params[1]
+                centers = np.array([(c.x, c.y) for c in (rects[i].get_mass_center() for i in group)])
+                x, y = _floor_to_image(params, centers[:, 0], centers[:, 1])
+                x /= ax
+                y /= ay
+                x1, x2 = ((x - crop_length) * ax).astype(int).tolist(), ((x + crop_length) * ax).astype(int).tolist()
+                y1, y2 = ((y - crop_length) * ay).astype(int).tolist(), ((y + crop_length) * ay).astype(int).tolist()
+                for j, i in enumerate(group):
+                    jobs[i] = pool.submit(self._get_crop_image, images, rotation, x1[j], x2[j], y1[j], y2[j], rects[i])
+            images = [job.result() for job in jobs]
+        return [self._save_crop_image(out_img, f'{rect.id}') for rect, out_img in zip(rects, images)]
+
     def _make(self, floor: 'Floor', cr: 'GeomPoint2D', dx: float, dy: float, rect: Optional['Rect']) -> Tuple[int, 'np.ndarray']:
         """
         Generate image for a given coordinate (x, y).
@@ -407,104 +503,139 @@ class RectFloorPhoto(BaseImage):
         :param rect: Optional rect
         :return: Returns the image index on the library array
         """
-        assert dx > 0 and dy > 0
-        image, original_shape = self._get_floor_image(floor)
-
-        # Compute crop area
-        sc = floor.image_scale
-        sx = floor.mutator_scale_x
-        sy = -floor.mutator_scale_y
-
-        # Image size in px
-        h, w, _ = image.shape
-
-        # Original center (non rotated)
-        rc2 = original_shape.clone()
-        rc2.scale(0.5)
+        *crop, figname = self._get_crop_region(floor, cr, dx, dy, rect)
+        return self._save_crop_image(self._get_crop_image(*crop, rect), figname)
 
-        # Compute true point based on rotation
-        ax = sc / _sgn(sx)
-        ay = sc / _sgn(sy)
-        cr.rotate(GeomPoint2D(), -floor.mutator_angle)
+    @staticmethod
+    def _get_floor_hash(floor: 'Floor') -> Tuple[int, float, float]:
+        """
+        :param floor: Floor object
+        :return: Key of the processed floor image
+        """
+        return floor.id, floor.mutator_scale_x, floor.mutator_scale_y  # Tuple, an id/scale concatenation is ambiguous
 
-        # Scale to pixels
-        cr.x *= ax
-        cr.y *= ay
+    @staticmethod
+    def _get_floor_params(
+            floor: 'Floor',
+            image: 'np.ndarray',
+            reduce_factor: int = 1
+    ) -> Tuple[Tuple[float, ...], Optional[Tuple['np.ndarray', int, int]]]:
+        """
+        Compute the transformation from floor coordinates to the rotated floor image.
 
-        if sx < 0:
-            cr.x = original_shape.x - cr.x
-        if sy > 0:
-            cr.y = original_shape.y - cr.y
+        :param floor: Floor object
+        :param image: Processed floor image, not rotated
+        :param reduce_factor: Reduction of the floor image size
+        :return: Transformation parameters, and the rotation of the image (matrix, width, height) if any
+        """
+        sc = floor.image_scale / reduce_factor
+        sx = floor.mutator_scale_x
+        sy = -floor.mutator_scale_y
+        angle = floor.mutator_angle * math.pi / 180
+        phi = math.pi * (1 - floor.mutator_angle / 180)
+        oh, ow, _ = image.shape
+        original_shape = GeomPoint2D(ow, oh)
+        rotation = None
+        if floor.mutator_angle == 0:
+            h, w = oh, ow
+        else:
+            rotation = _get_rotation_bound(oh, ow, floor.mutator_angle)
+            w, h = rotation[1], rotation[2]
+        return (
+            math.copysign(sc, sx), math.copysign(sc, sy),  # Scale to pixels
+            math.cos(-angle), math.sin(-angle),  # Undo the rotation
+            original_shape.x if sx < 0 else 0, original_shape.y if sy > 0 else 0,  # Flip
+            -1 if sx < 0 else 1, -1 if sy > 0 else 1,
+            original_shape.x / 2, original_shape.y / 2,  # Original center (non rotated)
+            math.cos(phi), math.sin(phi),
+            w / 2, h / 2  # Image center
+        ), rotation
+
+    def _get_floor_transform(
+            self,
+            floor: 'Floor'
+    ) -> Tuple[List['np.ndarray'], Tuple[float, ...], Optional[Tuple['np.ndarray', int, int]]]:
+        """
+        Get the processed floor image, and the transformation from floor coordinates to the rotated image.
 
-        # Compute the distance to original center and angle
-        r = cr.dist(rc2)
-        theta = cr.angle(rc2)
-        del rc2
+        :param floor: Floor object
+        :return: Image array pyramid (not rotated), transformation parameters, and image rotation
+        """
+        images = self._get_floor_image(floor)
+        floor_params = self._floor_params.setdefault(self._get_floor_hash(floor), {})
+        params = floor_params.get(floor.mutator_angle)
+        if params is None:
+            params = self._get_floor_params(floor, images[0], self._reduce_factor)
+            floor_params[floor.mutator_angle] = params
+        return (images,) + params
+
+    def _get_crop_region(
+            self,
+            floor: 'Floor',
+            cr: 'GeomPoint2D',
+            dx: float,
+            dy: float,
+            rect: Optional['Rect']
+    ) -> Tuple[List['np.ndarray'], Optional[Tuple['np.ndarray', int, int]], int, int, int, int, str]:
+        """
+        Compute the region of the rotated floor image for a given coordinate (x, y).
 
-        # Create point from current center using radius and computed angle
-        cr.x = w / 2 + r * math.cos(theta + math.pi * (1 - floor.mutator_angle / 180))
-        cr.y = h / 2 + r * math.sin(theta + math.pi * (1 - floor.mutator_angle / 180))
+        :param floor: Object floor to process
+        :param cr: Coordinate to process
+        :param dx: Half crop distance on x-axis (m)
+        :param dy: Half crop distance on y-axis (m)
+        :param rect: Optional rect
+        :return: Floor image pyramid, image rotation, region x1, x2, y1, y2 (px), and the image name
+        """
+        assert dx > 0 and dy > 0
+        images, params, rotation = self._get_floor_transform(floor)
+        ax, ay = params[0], params[1]
+        x, y = _floor_to_image(params, cr.x, cr.y)
 
         if self._verbose:
             if rect is not None:
                 print(f'Processing rect ID <{rect.id}>')
-            ce = GeomPoint2D(w / 2, h / 2)
-            _show_dot_image(image, [ce, cr], [[255, 255, 255], [255, 0, 0]])
-
-        # Scale back
-        cr.x /= ax
-        cr.y /= ay
+            _show_dot_image(_rotate_image(images[0], floor.mutator_angle), [(params[-2], params[-1]), (x, y)],
+                            [[255, 255, 255], [255, 0, 0]])
 
-        # Create region
-        xmin = cr.x - dx
-        xmax = cr.x + dx
-        ymin = cr.y - dy
-        ymax = cr.y + dy
+        # Scale back, and create region
+        x /= ax
+        y /= ay
+        xmin = x - dx
+        xmax = x + dx
+        ymin = y - dy
+        ymax = y + dy
 
-        image: 'np.ndarray' = self._get_floor_image(floor)[0]
         figname = f'{rect.id}' if rect else f'{floor.id}-x-{xmin:.2f}-{xmax:.2f}-y-{ymin:.2f}-{ymax:.2f}'
+        return images, rotation, int(xmin * ax), int(xmax * ax), int(ymin * ay), int(ymax * ay), figname
 
-        # Get cropped and resized box
-        out_img: 'np.ndarray' = self._get_crop_image(
-            image=image,
-            x1=int(xmin * ax),
-            x2=int(xmax * ax),
-            y1=int(ymin * ay),
-            y2=int(ymax * ay),
-            rect=rect)
+    def _save_crop_image(self, out_img: 'np.ndarray', figname: str) -> Tuple[int, 'np.ndarray']:
+        """
+        Save a cropped image to file and to the library array.
 
+        :param out_img: Cropped image (BGR)
+        :param figname: Image name
+        :return: Returns the image index on the library array, and the image (RGB)
+        """
         if self._save_images:
             assert self._path != '', 'Path cannot be empty'
             filesave = os.path.join(self._path, figname + '.png')
-            cv2.imwrite(filesave, out_img)
+            self._write_image(filesave, out_img)
 
-        # Save to array
-        out_img_rgb = cv2.cvtColor(out_img, cv2.COLOR_BGR2RGB)
+        # Save to array as rgb, converted in place within the library array
         if self.save:
-            self._images.append(out_img_rgb)  # Save as rgb
-            self._names.append(figname)
-
-        self._processed_images += 1
-        if self._processed_images % IMAGES_TO_CLEAR_MEMORY == 0:
-            gc.collect()
-
-        # Clear memory
-        del out_img
+            index, out_img_rgb = self._new_image(out_img.shape, figname)
+            cv2.cvtColor(out_img, cv2.COLOR_BGR2RGB, dst=out_img_rgb)
+        else:
+            index, out_img_rgb = self._num_images - 1, cv2.cvtColor(out_img, cv2.COLOR_BGR2RGB)
 
         # Returns the image index on the library array
-        return len(self._names) - 1, out_img_rgb  # Images array can change during export
-
-    def _get_empty_image(self) -> 'np.ndarray':
-        """
-        :return: Desired output image with default empty color
-        """
-        img: 'np.ndarray' = np.ones((self._image_size, self._image_size, 3)) * self._empty_color
-        img = img.astype(TYPE_IMAGE)
-        return img
+        return index, out_img_rgb  # Images array can change during export
 
     def _get_crop_image(
             self,
-            image: 'np.ndarray',
+            images: List['np.ndarray'],
+            rotation: Optional[Tuple['np.ndarray', int, int]],
             x1: int,
             x2: int,
             y1: int,
@@ -514,7 +645,8 @@ class RectFloorPhoto(BaseImage):
         """
         Create crop image.
 
-        :param image: Source image array
+        :param images: Source image array pyramid (not rotated)
+        :param rotation: Rotation matrix and rotated image size, None if not rotated
         :param x1: Min pos (x axis)
         :param x2: Max pos (x axis)
         :param y1: Min pos (y axis)
@@ -522,57 +654,67 @@ class RectFloorPhoto(BaseImage):
         :param rect: Rect object from the image
         :return: Cropped image
         """
-        x = [x1, x2]
-        y = [y1, y2]
-        x1, x2 = min(x), max(x)
-        y1, y2 = min(y), max(y)
-        ww = int(x2 - x1)
-        hh = int(y2 - y1)
-        out_img = np.zeros((ww, hh, 3))
-        w, h, _ = image.shape  # Real image size
-        dx = 0
-        if x1 < 0:
-            dx = - x1
-            x1 = 0
-        if x1 + hh > h:
-            hh = max(0, h - x1)
-        dy = 0
-        if y1 < 0:
-            dy = -y1
-            y1 = 0
-        if y1 + ww > w:
-            ww = max(0, w - y1)
-        if ww - dy > 0 and hh - dx > 0:
-            _x2 = x1 + hh - dx
-            _y2 = y1 + ww - dy
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+
+        # Use the smallest level that is still twice the output size, the final resize keeps the quality
+        level = 0
+        while level + 1 < len(images) and min(x2 - x1, y2 - y1) >> (level + 1) >= 2 * self._image_size:
+            level += 1
+        image = images[level]
+        if level > 0:
+            f = 1 << level
+            x1, x2, y1, y2 = x1 // f, x2 // f, y1 // f, y2 // f
+
+        if rotation is None:
+            h, w, _ = image.shape  # Real image size
+        else:
+            rot_mat, w, h = rotation
+            if level > 0:
+                rot_mat = rot_mat.copy()
+                rot_mat[:, 2] /= f
+                w, h = -(-w // f), -(-h // f)
+
+        # Region within the image, the rest is filled with zeros
+        sx1, sx2 = max(x1, 0), min(x2, w)
+        sy1, sy2 = max(y1, 0), min(y2, h)
+        if sx2 > sx1 and sy2 > sy1:
             if self._verbose:
-                print(f'\tRead from x:{x1}->{_x2} to y:{y1}->{_y2}')
-                print(f'\t{dy}', dx, y1, x1, ww, hh)
-                _show_frame_image(image, x1, y1, x2, y2)
-            try:
-                out_img[dy:dy + ww, dx:dx + hh] = image[y1:_y2, x1:_x2]
-            except ValueError as e:
-                if rect is not None:
-                    print(f'Shape inconsistency at rect ID <{rect.id}>, Floor ID {rect.floor.id}')
-                raise RectFloorShapeException(str(e))
-
-        """
-        Good:       INTER_AREA
-        Not good:   INTER_LANCZOS4, INTER_BITS, INTER_CUBIC, INTER_LINEAR,
-                    INTER_LINEAR_EXACT
-        Bad:        INTER_NEAREST
-        """
-        out_rz: 'np.ndarray' = cv2.resize(out_img, (self._image_size, self._image_size),
-                                          interpolation=cv2.INTER_AREA)
-        # if self._verbose:
-        #     print('Process finished in {0} seconds'.format(int(time.time() - t)))
-        im = out_rz.astype(TYPE_IMAGE)
+                print(f'\tRead from x:{sx1}->{sx2} to y:{sy1}->{sy2}')
+                _show_frame_image(image if rotation is None else cv2.warpAffine(image, rot_mat, (w, h)),
+                                  x1, y1, x2, y2)
+            if rotation is None:
+                crop = image[sy1:sy2, sx1:sx2]  # View, the source is not copied
+                if (sx1, sx2, sy1, sy2) != (x1, x2, y1, y2):
+                    crop = cv2.copyMakeBorder(crop, sy1 - y1, y2 - sy2, sx1 - x1, x2 - sx2,
+                                              borderType=cv2.BORDER_CONSTANT, value=(0, 0, 0))
+            else:  # Rotate only the region, not the whole image. Pixels outside the image are filled by the border
+                tr = rot_mat.copy()
+                tr[0, 2] -= x1
+                tr[1, 2] -= y1
+                # If every pixel maps to an integer position (right angles), the nearest pixel is exact and faster
+                flags = cv2.INTER_NEAREST if np.array_equal(tr, np.rint(tr)) else cv2.INTER_LINEAR
+                crop = cv2.warpAffine(image, tr, (x2 - x1, y2 - y1), flags=flags,
+                                      borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+
+            """
+            Good:       INTER_AREA
+            Not good:   INTER_LANCZOS4, INTER_BITS, INTER_CUBIC, INTER_LINEAR,
+                        INTER_LINEAR_EXACT
+            Bad:        INTER_NEAREST
+            """
+            if crop.shape[0] == crop.shape[1] == self._image_size:
+                im = crop.copy()  # The crop can be a view of the floor image, which is adjusted later
+            else:
+                im = cv2.resize(crop, (self._image_size, self._image_size), interpolation=cv2.INTER_AREA)
+        else:
+            im = np.zeros((self._image_size, self._image_size, 3), dtype=TYPE_IMAGE)
+
         _alpha = -5
-        if self._empty_color == 0:
-            adjusted: 'np.ndarray' = cv2.convertScaleAbs(im, alpha=_alpha, beta=0)
+        if self._empty_color == 0:  # The resized image is not shared, thus, it is adjusted in place
+            adjusted: 'np.ndarray' = cv2.convertScaleAbs(im, dst=im, alpha=_alpha, beta=0)
         else:
             adjusted = im
-        # _swap_colors(adjusted, 0, self._empty_color)
 
         # Apply kernel
         image_kernel = cv2.filter2D(adjusted, -1, self._kernel)
@@ -586,15 +728,16 @@ class RectFloorPhoto(BaseImage):
         """
         Close and delete all generated figures.
         """
-        self._names.clear()
-        self._processed_images = 0
-        self._images.clear()
+        self._flush_images(shutdown=True)
+        self._clear_images()
         self._floor_images.clear()
-        self._floor_center_d.clear()
-        gc.collect()
+        self._floor_params.clear()
 
 
 class RectFloorShapeException(Exception):
     """
     Custom exception from rect floor generation image.
+
+    Deprecated, it is no longer raised, as the crop is clipped to the floor image and the rest is filled with zeros.
+    It will be removed in a future version.
     """
@@ -7,23 +7,45 @@ Line definition class.
 __all__ = [
     'BoundingBox',
     'GeomLine2D',
-    'GeomPoint2D'
+    'GeomPoint2D',
+    'LineArray',
+    'PointArray'
 ]
 
 from MLStructFP.utils._mathlib import dist2
-from MLStructFP._types import Dict, Any, List, Union, Tuple, NumberType, NumberInstance
+from MLStructFP._types import TYPE_CHECKING, Dict, Any, List, Optional, Union, Tuple, NumberType, NumberInstance
 
 import math
-import matplotlib.pyplot as plt
+import numpy as np
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 MIN_TOL: float = 1e-12
 
 
+def _points_to_arrays(point_list: Union[List['GeomPoint2D'], 'PointArray']) -> Tuple['np.ndarray', 'np.ndarray']:
+    """
+    Returns the coordinates of a point list as arrays.
+
+    :param point_list: Point list, or point array
+    :return: X and Y coordinates
+    """
+    if isinstance(point_list, PointArray):
+        return point_list.xs, point_list.ys
+    n = len(point_list)
+    return np.fromiter((p.x for p in point_list), np.float64, n), np.fromiter((p.y for p in point_list), np.float64, n)
+
+
 class GeomLine2D(object):
     """
     Geometric 2d segment between 2 points.
     """
     _def_points: Dict[str, 'GeomPoint2D']
+    _dx: float  # Delta of the definition points, updated with _set_def_points
+    _dy: float
+    _norm: float  # Norm of the line normal (-m, 1), computed for _norm_m
+    _norm_m: NumberType
     m: NumberType
     n: NumberType
     theta: NumberType
@@ -35,10 +57,22 @@ class GeomLine2D(object):
         self.m = 0.0
         self.theta = 0.0
         self.n = 0.0
-        self._def_points = dict(
-            p1=GeomPoint2D(),
-            p2=GeomPoint2D()
-        )
+        self._norm = 1.0
+        self._norm_m = 0.0
+        self._def_points = {}
+        self._set_def_points(GeomPoint2D(), GeomPoint2D())
+
+    def _set_def_points(self, p1: 'GeomPoint2D', p2: 'GeomPoint2D') -> None:
+        """
+        Set the definition points of the segment.
+
+        :param p1: Point 1
+        :param p2: Point 2
+        """
+        self._def_points['p1'] = p1
+        self._def_points['p2'] = p2
+        self._dx = p2.x - p1.x
+        self._dy = p2.y - p1.y
 
     def clone(self) -> 'GeomLine2D':
         """
@@ -50,8 +84,7 @@ class GeomLine2D(object):
         line.m = self.m
         line.theta = self.theta
         line.n = self.n
-        line._def_points['p1'] = self._def_points['p1'].clone()
-        line._def_points['p2'] = self._def_points['p2'].clone()
+        line._set_def_points(self._def_points['p1'].clone(), self._def_points['p2'].clone())
         return line
 
     def __str__(self) -> str:
@@ -68,8 +101,7 @@ class GeomLine2D(object):
         :param p2: Point 2
         :return: Self
         """
-        self._def_points['p1'] = p1.clone()
-        self._def_points['p2'] = p2.clone()
+        self._set_def_points(p1.clone(), p2.clone())
         m_a = p2.y - p1.y
         m_b = p2.x - p1.x + MIN_TOL
         self.m = m_a / m_b
@@ -100,8 +132,7 @@ class GeomLine2D(object):
         Checks defined points are none.
         """
         if self._def_points['p1'] is None or self._def_points['p2'] is None:
-            self._def_points['p1'] = self.f(0)
-            self._def_points['p2'] = self.f(1)
+            self._set_def_points(self.f(0), self.f(1))
 
     def point_left(self, p: 'GeomPoint2D') -> bool:
         """
@@ -112,8 +143,19 @@ class GeomLine2D(object):
         """
         self._check_def_none()
         p1: 'GeomPoint2D' = self._def_points['p1']
-        p2: 'GeomPoint2D' = self._def_points['p2']
-        return (((p2.x - p1.x) * (p.y - p1.y)) - ((p2.y - p1.y) * (p.x - p1.x))) > 0
+        return ((self._dx * (p.y - p1.y)) - (self._dy * (p.x - p1.x))) > 0
+
+    def point_left_many(self, xs: 'np.ndarray', ys: 'np.ndarray') -> 'np.ndarray':
+        """
+        Check several points are at left of the segment.
+
+        :param xs: X coordinates
+        :param ys: Y coordinates
+        :return: Boolean array, true if the point is located at the left of the segment
+        """
+        self._check_def_none()
+        p1: 'GeomPoint2D' = self._def_points['p1']
+        return ((self._dx * (np.asarray(ys) - p1.y)) - (self._dy * (np.asarray(xs) - p1.x))) > 0
 
     def point_on(self, p: 'GeomPoint2D') -> bool:
         """
@@ -124,20 +166,22 @@ class GeomLine2D(object):
         """
         self._check_def_none()
         p1: 'GeomPoint2D' = self._def_points['p1']
-        p2: 'GeomPoint2D' = self._def_points['p2']
-        return math.fabs((((p2.x - p1.x) * (p.y - p1.y)) - ((p2.y - p1.y) * (p.x - p1.x)))) < MIN_TOL
+        return -MIN_TOL < ((self._dx * (p.y - p1.y)) - (self._dy * (p.x - p1.x))) < MIN_TOL
 
-    def ortho_distance_point_list(self, point_list: List['GeomPoint2D']) -> List[NumberType]:
+    def ortho_distance_point_list(self, point_list: Union[List['GeomPoint2D'], 'PointArray']) -> List[NumberType]:
         """
         Calculate the orthographic distance from a point.
 
-        :param point_list: Point list
+        :param point_list: Point list, or point array (faster for repeated queries)
         :return: Distance list
         """
-        dist = []
-        for i in range(len(point_list)):
-            dist.append(self.ortho_distance_point(point_list[i]))
-        return dist
+        xs, ys = _points_to_arrays(point_list)
+        d = xs * -self.m  # Single buffer, the remaining operations are made in-place
+        d += ys
+        d -= self.n
+        np.abs(d, out=d)
+        d /= self._get_norm()
+        return d.tolist()
 
     def ortho_distance_point(self, p: 'GeomPoint2D') -> NumberType:
         """
@@ -146,10 +190,7 @@ class GeomLine2D(object):
         :param p: Point
         :return: Distance
         """
-        a = -self.m
-        b = 1
-        c = -self.n
-        return math.fabs((a * p.x) + (b * p.y) + c) / dist2(a, b)
+        return math.fabs((-self.m * p.x) + p.y - self.n) / self._get_norm()
 
     def ortho_distance_line(self, line: 'GeomLine2D', force: bool = False) -> NumberType:
         """
@@ -159,19 +200,29 @@ class GeomLine2D(object):
         :param force: If true, vertical segments will be evaluated on x-axis
         :return: Distance
         """
-        if math.fabs(math.fabs(self.m) - math.fabs(line.m)) > 1e-4:
+        if abs(abs(self.m) - abs(line.m)) > 1e-4:  # Builtin abs avoids the module attribute lookups
             if not force:
                 return math.inf
             else:
                 return math.fabs(self.eval(0) - line.eval(0))
-        return math.fabs(self.n - line.n) / dist2(1, self.m)
+        return math.fabs(self.n - line.n) / self._get_norm()
+
+    def _get_norm(self) -> float:
+        """
+        :return: Norm of the line normal, it is only computed again if the slope changes
+        """
+        if self.m != self._norm_m:
+            self._norm_m = self.m
+            self._norm = dist2(self.m, 1)
+        return self._norm
 
 
 class GeomPoint2D(object):
     """
     2D coordinate.
     """
-    _data: Dict[str, Any]
+    __slots__ = ('_data', 'x', 'y')  # Points are created in bulk, thus, they have no instance dict
+    _data: Optional[Dict[str, Any]]
     x: NumberType
     y: NumberType
 
@@ -186,7 +237,22 @@ class GeomPoint2D(object):
         assert isinstance(y, NumberInstance)
         self.x = float(x)
         self.y = float(y)
-        self._data = {}  # Point inner data
+        self._data = None  # Point inner data, created on the first property
+
+    @staticmethod
+    def _unchecked(x: float, y: float) -> 'GeomPoint2D':
+        """
+        Create a point from coordinates that are already floats, skipping the checks of the constructor.
+
+        :param x: X coordinate
+        :param y: Y coordinate
+        :return: New point
+        """
+        p = GeomPoint2D.__new__(GeomPoint2D)
+        p.x = x
+        p.y = y
+        p._data = None
+        return p
 
     def __eq__(self, other: 'GeomPoint2D') -> bool:
         return math.fabs(self.x - other.x) <= MIN_TOL and math.fabs(self.y - other.y) <= MIN_TOL
@@ -265,21 +331,25 @@ class GeomPoint2D(object):
         """
         if angle == 0:
             return self
+        r = angle * math.pi / 180
+        return self.rotate_precomputed(center, math.sin(r), math.cos(r))
 
-        s = math.sin(angle * math.pi / 180)
-        c = math.cos(angle * math.pi / 180)
+    def rotate_precomputed(self, center: 'GeomPoint2D', sin_a: float, cos_a: float) -> 'GeomPoint2D':
+        """
+        Rotate the point around a given center, given the sine and cosine of the angle. Useful to rotate many points.
 
+        :param center: Rotation center
+        :param sin_a: Sine of the rotation angle
+        :param cos_a: Cosine of the rotation angle
+        :return: Self
+        """
         # Translate
-        self.x -= center.x
-        self.y -= center.y
+        x = self.x - center.x
+        y = self.y - center.y
 
-        # Rotate
-        new_x = self.x * c - self.y * s
-        new_y = self.x * s + self.y * c
-
-        # Update
-        self.x = new_x + center.x
-        self.y = new_y + center.y
+        # Rotate, and update
+        self.x = x * cos_a - y * sin_a + center.x
+        self.y = x * sin_a + y * cos_a + center.y
         return self
 
     def scale(self, s: float) -> 'GeomPoint2D':
@@ -293,27 +363,31 @@ class GeomPoint2D(object):
         self.y *= s
         return self
 
-    def dist(self, other: 'GeomPoint2D') -> float:
+    def dist(self, other: Union['GeomPoint2D', 'PointArray', 'np.ndarray']) -> Union[float, List[float]]:
         """
-        Returns the distance between two points.
+        Returns the distance between two points. If a point array, or a (n, 2) coordinate
+        array is given, the distances to all the points are computed at once.
 
-        :param other: Point
-        :return: Distance
+        :param other: Point, point array, or coordinate array
+        :return: Distance, or distance list
         """
+        if isinstance(other, PointArray):
+            return np.hypot(other.xs - self.x, other.ys - self.y).tolist()
+        if isinstance(other, np.ndarray):
+            assert other.ndim == 2 and other.shape[1] == 2, 'coordinate array must have (n, 2) shape'
+            return np.hypot(other[:, 0] - self.x, other[:, 1] - self.y).tolist()
         return dist2(self.x, self.y, other.x, other.y)
 
-    def angle(self, other: Union['GeomPoint2D', List['GeomPoint2D']]) -> Union[float, List[float]]:
+    def angle(self, other: Union['GeomPoint2D', List['GeomPoint2D'], 'PointArray']) -> Union[float, List[float]]:
         """
         Returns the angle between two points.
 
-        :param other: Point
+        :param other: Point, point list, or point array
         :return: Angle
         """
-        if isinstance(other, list):
-            dist = []
-            for i in range(len(other)):
-                dist.append(self.angle(other[i]))
-            return dist
+        if isinstance(other, (list, PointArray)):  # Equal points have no difference, thus, the angle is also 0
+            xs, ys = _points_to_arrays(other)
+            return np.arctan2(ys - self.y, xs - self.x).tolist()
         if self.x == other.x and self.y == other.y:
             return 0.0
         return math.atan2(other.y - self.y, other.x - self.x)
@@ -328,6 +402,8 @@ class GeomPoint2D(object):
         if data is None:
             return
         assert isinstance(key, str)
+        if self._data is None:
+            self._data = {}
         self._data[key] = data
 
     def get_property(self, key: str, default: Any = None) -> Any:
@@ -338,9 +414,9 @@ class GeomPoint2D(object):
         :param default: Data
         :return: Value
         """
-        if not self.has_property(key):
+        if self._data is None:
             return default
-        return self._data[key]
+        return self._data.get(key, default)
 
     def has_property(self, key: str) -> bool:
         """
@@ -349,7 +425,7 @@ class GeomPoint2D(object):
         :param key: Key
         :return: True if key exists
         """
-        return key in self._data.keys()
+        return self._data is not None and key in self._data
 
     def clone(self) -> 'GeomPoint2D':
         """
@@ -357,9 +433,9 @@ class GeomPoint2D(object):
 
         :return: New point
         """
-        p = GeomPoint2D(self.x, self.y)
-        for k in self._data.keys():
-            p.set_property(k, self.get_property(k))
+        p = GeomPoint2D._unchecked(self.x, self.y)
+        if self._data is not None:
+            p._data = self._data.copy()  # Stored values are never None
         return p
 
     def equals(self, other: 'GeomPoint2D') -> bool:
@@ -387,12 +463,167 @@ class GeomPoint2D(object):
         :param marker_size: Marker size
         :param style: Marker style
         """
+        import matplotlib.pyplot as plt  # Imported on demand, it is expensive
         assert isinstance(ax, plt.Axes)
         assert isinstance(color, str)
         assert isinstance(marker_size, int)
         assert isinstance(style, str)
         ax.plot(self.x, self.y, style, markersize=marker_size, color=color)
 
+    @staticmethod
+    def plot_many(
+            ax: 'plt.Axes',
+            points: Union[List['GeomPoint2D'], 'PointArray'],
+            color='#000000',
+            marker_size: int = 10,
+            style: str = '.'
+    ) -> None:
+        """
+        Plot several points as a single artist, which is much faster than plotting each point.
+
+        :param ax: Matplotlib axes
+        :param points: Point list, or point array
+        :param color: Marker color
+        :param marker_size: Marker size
+        :param style: Marker style
+        """
+        import matplotlib.pyplot as plt  # Imported on demand, it is expensive
+        assert isinstance(ax, plt.Axes)
+        assert isinstance(color, str)
+        assert isinstance(marker_size, int)
+        assert isinstance(style, str)
+        xs, ys = _points_to_arrays(points)
+        ax.plot(xs, ys, style, markersize=marker_size, color=color, linestyle='none')
+
+
+class PointArray(object):
+    """
+    List of 2D coordinates, stored as contiguous x and y arrays. Bulk operations (angle, distance) use it directly.
+    """
+    xs: 'np.ndarray'
+    ys: 'np.ndarray'
+
+    def __init__(self, xs: Any, ys: Any) -> None:
+        """
+        Constructor.
+
+        :param xs: X coordinates
+        :param ys: Y coordinates
+        """
+        self.xs = np.ascontiguousarray(xs, dtype=np.float64).reshape(-1)
+        self.ys = np.ascontiguousarray(ys, dtype=np.float64).reshape(-1)
+        assert len(self.xs) == len(self.ys), 'Coordinates must have the same length'
+
+    @staticmethod
+    def from_points(point_list: List['GeomPoint2D']) -> 'PointArray':
+        """
+        Create the array from a point list.
+
+        :param point_list: Point list
+        :return: New point array
+        """
+        return PointArray(*_points_to_arrays(point_list))
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    def rotate(self, center: 'GeomPoint2D', angle: float = 0) -> 'PointArray':
+        """
+        Rotate all points around a given center, same as GeomPoint2D.rotate.
+
+        :param center: Rotation center
+        :param angle: Rotation angle, angles in degrees
+        :return: Self
+        """
+        if angle == 0:
+            return self
+        r = angle * math.pi / 180
+        s, c = math.sin(r), math.cos(r)
+        x = self.xs - center.x
+        y = self.ys - center.y
+        self.xs = x * c - y * s + center.x
+        self.ys = x * s + y * c + center.y
+        return self
+
+    def __getitem__(self, i: int) -> 'GeomPoint2D':
+        """
+        Returns a point from the array. Changes to the point are not stored in the array.
+
+        :param i: Index
+        :return: Point
+        """
+        return GeomPoint2D._unchecked(float(self.xs[i]), float(self.ys[i]))
+
+    def __repr__(self) -> str:
+        return f'PointArray({len(self)} points)'
+
+
+class LineArray(object):
+    """
+    List of lines, stored as contiguous slope, intercept and angle arrays. Lines are computed as
+    GeomLine2D.from_2_points, but without creating the line objects.
+    """
+    m: 'np.ndarray'
+    n: 'np.ndarray'
+    theta: 'np.ndarray'
+
+    def __init__(self, m: Any, n: Any, theta: Any) -> None:
+        """
+        Constructor.
+
+        :param m: Slopes
+        :param n: Intercepts
+        :param theta: Angles
+        """
+        self.m = np.ascontiguousarray(m, dtype=np.float64).reshape(-1)
+        self.n = np.ascontiguousarray(n, dtype=np.float64).reshape(-1)
+        self.theta = np.ascontiguousarray(theta, dtype=np.float64).reshape(-1)
+        assert len(self.m) == len(self.n) == len(self.theta), 'Line arrays must have the same length'
+
+    @staticmethod
+    def from_points(p1: 'PointArray', p2: 'PointArray') -> 'LineArray':
+        """
+        Create the lines from two point arrays, the i-th line passes through p1[i] and p2[i].
+
+        :param p1: Point 1 array
+        :param p2: Point 2 array
+        :return: New line array
+        """
+        assert len(p1) == len(p2), 'Point arrays must have the same length'
+        m_a = p2.ys - p1.ys
+        m_b = p2.xs - p1.xs + MIN_TOL
+        m = m_a / m_b
+        return LineArray(m, (-m * p1.xs) + p2.ys, np.arctan2(m_a, m_b))
+
+    def __len__(self) -> int:
+        return len(self.m)
+
+    def ortho_distance_point(self, p: 'GeomPoint2D') -> 'np.ndarray':
+        """
+        Returns the orthographic distance from a point to each line.
+
+        :param p: Point
+        :return: Distance array
+        """
+        return np.abs((-self.m * p.x) + p.y - self.n) / np.sqrt(self.m * self.m + 1)
+
+    def __getitem__(self, i: int) -> 'GeomLine2D':
+        """
+        Returns a line from the array, its definition points are evaluated at x=0 and x=1.
+
+        :param i: Index
+        :return: Line
+        """
+        line = GeomLine2D()
+        line.m = float(self.m[i])
+        line.n = float(self.n[i])
+        line.theta = float(self.theta[i])
+        line._set_def_points(line.f(0), line.f(1))
+        return line
+
+    def __repr__(self) -> str:
+        return f'LineArray({len(self)} lines)'
+
 
 class BoundingBox(object):
     """
@@ -430,3 +661,34 @@ class BoundingBox(object):
 
     def __repr__(self) -> str:
         return f'BB: x({self.xmin},{self.xmax}), y({self.ymin},{self.ymax})'
+
+    @staticmethod
+    def from_points_array(xs: Any, ys: Any) -> 'BoundingBox':
+        """
+        Create the bounding box of the given coordinates.
+
+        :param xs: X coordinates
+        :param ys: Y coordinates
+        :return: Bounding box
+        """
+        return BoundingBox(float(np.min(xs)), float(np.max(xs)), float(np.min(ys)), float(np.max(ys)))
+
+    @staticmethod
+    def stack(bbs: List['BoundingBox']) -> 'np.ndarray':
+        """
+        Stack bounding boxes for the vectorized tests.
+
+        :param bbs: Bounding box list
+        :return: (n, 4) array of (xmin, xmax, ymin, ymax)
+        """
+        return np.array([(bb.xmin, bb.xmax, bb.ymin, bb.ymax) for bb in bbs], dtype=np.float64).reshape(-1, 4)
+
+    def intersects_many(self, bbs: 'np.ndarray') -> 'np.ndarray':
+        """
+        Check the intersection with several bounding boxes. Touching boxes intersect.
+
+        :param bbs: (n, 4) array of (xmin, xmax, ymin, ymax), see stack
+        :return: Boolean array, true if the box intersects
+        """
+        return ~((bbs[:, 1] < self.__xmin) | (bbs[:, 0] > self.__xmax) |
+                 (bbs[:, 3] < self.__ymin) | (bbs[:, 2] > self.__ymax))
@@ -22,7 +22,9 @@ def dist2(x1: float, y1: float, x2: float = 0.0, y2: float = 0.0) -> float:
     :param y2: Y2
     :return: Distance
     """
-    return _math.sqrt(_math.pow(x1 - x2, 2) + _math.pow(y1 - y2, 2))
+    dx = x1 - x2
+    dy = y1 - y2
+    return _math.sqrt(dx * dx + dy * dy)
 
 
 def dist3(x1: float, y1: float, z1: float, x2: float = 0.0, y2: float = 0.0, z2: float = 0.0) -> float:
@@ -37,4 +39,7 @@ def dist3(x1: float, y1: float, z1: float, x2: float = 0.0, y2: float = 0.0, z2:
     :param z2: Z2
     :return: Distance
     """
-    return _math.sqrt(_math.pow(x1 - x2, 2) + _math.pow(y1 - y2, 2) + _math.pow(z1 - z2, 2))
+    dx = x1 - x2
+    dy = y1 - y2
+    dz = z1 - z2
+    return _math.sqrt(dx * dx + dy * dy + dz * dz)
@@ -9,12 +9,16 @@ __all__ = ['make_dirs']
 import os
 
 
-def make_dirs(f: str) -> None:
+def make_dirs(f: str) -> str:
     """
     Create dir if not exists.
 
     :param f: Filename
+    :return: Filename
     """
+    if f == '':
+        return f
     fdir = os.path.dirname(f)
-    if f != '':
+    if fdir != '':
         os.makedirs(fdir, exist_ok=True)
+    return f
@@ -12,14 +12,18 @@ __all__ = [
     'save_figure'
 ]
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+from MLStructFP._types import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 # Some constants
 DEFAULT_PLOT_DPI: int = 250
 DEFAULT_PLOT_FIGSIZE: int = 6
 DEFAULT_PLOT_STYLE: str = 'default'  # https://matplotlib.org/3.1.1/gallery/style_sheets/style_sheets_reference.html
 
+_style_set: bool = False  # The default style is applied once, as it reloads the rc parameters
+
 
 def configure_figure(**kwargs) -> None:
     """
@@ -38,10 +42,10 @@ def configure_figure(**kwargs) -> None:
 
     :param kwargs: Optional keyword arguments
     """
+    import matplotlib.pyplot as plt  # Imported on demand, it is expensive
     ax: 'plt.Axes' = plt.gca()
     f_lbl = kwargs.get('cfg_fontsize_label', 14)
     f_tik = kwargs.get('cfg_fontsize_ticks', 14)
-    ax.yaxis.label.set_size(40)
 
     # Configure label size
     ax.xaxis.label.set_size(f_lbl)
@@ -64,7 +68,10 @@ def configure_figure(**kwargs) -> None:
     # mpl.rcParams['figure.dpi'] = kwargs.get('cfg_dpi', DEFAULT_PLOT_DPI)
 
     # Set current style
-    plt.style.use(DEFAULT_PLOT_STYLE)
+    global _style_set
+    if not _style_set:
+        plt.style.use(DEFAULT_PLOT_STYLE)
+        _style_set = True
 
     # Rotate ticks
     rot_xticks = kwargs.get('cfg_xticks_rotation', 0)
@@ -72,7 +79,7 @@ def configure_figure(**kwargs) -> None:
     if rot_xticks != 0:
         plt.xticks(rotation=rot_xticks)
     if rot_yticks != 0:
-        plt.xticks(rotation=rot_yticks)
+        plt.yticks(rotation=rot_yticks)
 
     if kwargs.get('cfg_equal_axis', False):
         plt.axis('square')
@@ -91,9 +98,13 @@ def save_figure(save: str, **kwargs) -> None:
     """
     if save == '':
         return
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
 
-    # Increases chunksize for larger plots
-    mpl.rcParams['agg.path.chunksize'] = 100000
+    # Increases chunksize for larger plots. The value is only written (and validated) if the
+    # parameter differs, as setting a style restores it
+    if mpl.rcParams['agg.path.chunksize'] != 100000:
+        mpl.rcParams['agg.path.chunksize'] = 100000
 
     dpi = kwargs.get('save_dpi', 3 * DEFAULT_PLOT_DPI)
     if kwargs.get('save_tight', True):
@@ -6,6 +6,7 @@ Build file.
 
 import os
 import shutil
+import subprocess
 import sys
 
 assert len(sys.argv) == 2, 'Argument is required, usage: build.py pip/twine'
@@ -19,12 +20,13 @@ if mode == 'pip':
     if os.path.isdir('build'):
         for k in os.listdir('build'):
             if 'bdist.' in k or k == 'lib':
-                shutil.rmtree(f'build/{k}')
-    os.system(f'python setup.py sdist bdist_wheel')
+                shutil.rmtree(f'build/{k}', ignore_errors=True)
+    subprocess.run([sys.executable, 'setup.py', 'sdist', 'bdist_wheel'], check=True)
 
 elif mode == 'twine':
     if os.path.isdir('dist'):
-        os.system(f'python -m twine upload dist/*')
+        subprocess.run([sys.executable, '-m', 'twine', 'upload', *(os.path.join('dist', k) for k in os.listdir('dist'))],
+                       check=True)
     else:
         raise FileNotFoundError('Not distribution been found, execute build.py pip')
 
@@ -17,10 +17,7 @@ requirements = [
     'matplotlib == 3.5.3',
     'numpy == 1.18.5',
     'opencv-python == 4.5.1.48',
-    'Pillow == 9.4.0',
-    'plotly == 5.11.0',
-    'requests == 2.28.1',
-    'six == 1.16.0'
+    'plotly == 5.11.0'
 ]
 
 # Setup library
@@ -42,6 +39,7 @@ setup(
     include_package_data=True,
     install_requires=requirements,
     extras_require={
+        'orjson': ['orjson'],
         'test': ['codecov', 'nose2']
     },
     keywords=MLStructFP.__keywords__,
@@ -4,23 +4,40 @@ MLSTRUCTFP - TEST - DB
 Test the dataset loader and object components (rect, slab, floor).
 """
 
+import copy
+import cv2
+import json
 import numpy as np
 import os
+import shutil
+import tempfile
 import unittest
 
-from MLStructFP.db import DbLoader
+from MLStructFP.db import DbLoader, Rect
+from MLStructFP._types import Tuple
 from MLStructFP.db.image import *
+from MLStructFP.db import _db_loader
+from MLStructFP.db.image import _rect_binary, _rect_photo
+from unittest import mock
 
 DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'fp.json')
 
 
 class DbLoaderTest(unittest.TestCase):
+    db: 'DbLoader'
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Load the dataset once, tests that modify the floors must use a copy.
+        """
+        cls.db = DbLoader(DB_PATH)
 
     def test_db_load(self) -> None:
         """
         Test db loader path and number of dataset items.
         """
-        db = DbLoader(DB_PATH)
+        db = self.db
         self.assertEqual(os.path.dirname(DB_PATH), db._path)
 
         # Test floors
@@ -48,11 +65,115 @@ class DbLoaderTest(unittest.TestCase):
         self.assertEqual(f.image_scale, 188.445)
         self.assertEqual(os.path.basename(f.image_path), 'f23ccf42b9c42bfe7c37a1fb7a1ea100e3d34596.png')
 
+    def test_db_polygons(self) -> None:
+        """
+        Test the rect corners of the dataset against the points of each rect.
+        """
+        polygons, floor_ids = self.db.get_rect_polygons()
+        rects = [r for f in self.db.floors for r in f.rect]
+        self.assertEqual(polygons.shape, (384, 4, 2))
+        self.assertEqual(floor_ids.tolist(), [r.floor.id for r in rects])
+        self.assertTrue(np.array_equal(polygons, [[(p.x, p.y) for p in r.points] for r in rects]))
+
+        # Mutations are included
+        db = copy.deepcopy(self.db)
+        db.floors[1].mutate(30, 2)
+        polygons = db.get_rect_polygons()[0]
+        self.assertTrue(np.array_equal(polygons, [[(p.x, p.y) for p in r.points] for f in db.floors for r in f.rect]))
+
+    def test_db_cache(self) -> None:
+        """
+        Test the disk cache of the db loader.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            data_path = os.path.join(tmp, 'data')
+            cache_path = os.path.join(tmp, 'cache')
+            shutil.copytree(os.path.dirname(DB_PATH), data_path)
+            db_path = os.path.join(data_path, 'fp.json')
+
+            def load() -> Tuple['DbLoader', bool]:
+                """
+                Load the dataset, and check whether it was assembled from the dataset file.
+                """
+                with mock.patch.object(DbLoader, '_assemble', autospec=True, side_effect=DbLoader._assemble) as m:
+                    loaded = DbLoader(db_path, cache_path=cache_path)
+                return loaded, m.called
+
+            # Cold load writes the cache, then, the warm load reads it
+            db, assembled = load()
+            self.assertTrue(assembled)
+            self.assertEqual(len(os.listdir(cache_path)), 1)
+            db_warm, assembled = load()
+            self.assertFalse(assembled)
+            self.assertEqual(len(db_warm.floor), 7)
+            self.assertTrue(np.array_equal(db_warm.get_rect_polygons()[0], db.get_rect_polygons()[0]))
+            self.assertEqual(db_warm.floor[302].image_path, db.floor[302].image_path)
+
+            # A new library version invalidates the cache
+            with mock.patch.object(_db_loader, '__version__', '0.0.0'):
+                self.assertTrue(load()[1])
+
+            # Changes of the dataset invalidate the cache, and the stale files are removed
+            with open(db_path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+            data['floor']['302']['scale'] = 100
+            with open(db_path, 'w', encoding='utf8') as f:
+                json.dump(data, f)
+            db_new, assembled = load()
+            self.assertTrue(assembled)
+            self.assertEqual(db_new.floor[302].image_scale, 100)
+            self.assertEqual(len(os.listdir(cache_path)), 1)
+            self.assertFalse(load()[1])
+
+    def test_rect_shape(self) -> None:
+        """
+        Test rects must have 4 corners, as the floor stacks them into a single array.
+        """
+        f = copy.deepcopy(self.db.floors[0])
+        with self.assertRaises(AssertionError):
+            Rect(rect_id=1, wall_id=1, floor=f, angle=0, length=1, thickness=0.1, x=[0, 1, 1], y=[0, 0, 1],
+                 line_m=0, line_n=0, line_theta=0)
+        self.assertEqual(f.get_rect_polygons().shape, (len(f.rect), 4, 2))
+
+    def test_plot(self) -> None:
+        """
+        Test plotting the rects as a single trace draws the same outlines as plotting each rect.
+        """
+        import plotly.graph_objects as go
+        f = self.db.floors[0]
+        for fig_each, fig_many in ((f.plot_basic(), f.plot_basic(merge_rects=True)),
+                                   (f.plot_complex(), f.plot_complex(merge_rects=True))):
+            self.assertEqual(len(fig_each.data), len(f.rect))
+            self.assertEqual(len(fig_many.data), 1)
+            self.assertEqual(fig_many.layout, fig_each.layout)  # Including the slabs
+            self.assertEqual(fig_many.data[0].fill, fig_each.data[0].fill)
+
+            # Each outline is followed by a gap
+            np.testing.assert_array_equal(fig_many.data[0].x, np.concatenate([(*t.x, np.nan) for t in fig_each.data]))
+            np.testing.assert_array_equal(fig_many.data[0].y, np.concatenate([(*t.y, np.nan) for t in fig_each.data]))
+
+        # The plot options are applied to the merged trace as to each rect
+        kwargs = dict(dx=1, dy=-2, color='#ff0000', opacity=0.5, show_legend=False)
+        fig_each, fig_many = f.plot_complex(**kwargs), f.plot_complex(merge_rects=True, **kwargs)
+        for key in ('line', 'opacity', 'showlegend', 'fill'):
+            self.assertEqual(fig_many.data[0][key], fig_each.data[0][key])
+        self.assertEqual(fig_many.data[0].line.color, '#ff0000')
+        np.testing.assert_array_equal(fig_many.data[0].x, np.concatenate([(*t.x, np.nan) for t in fig_each.data]))
+        np.testing.assert_array_equal(fig_many.data[0].y, np.concatenate([(*t.y, np.nan) for t in fig_each.data]))
+
+        # Displacement, and the polygons computed from the rects
+        fig_each, fig_many = go.Figure(), go.Figure()
+        for r in f.rect:
+            r.plot_plotly(fig_each, dx=1, dy=-2)
+        Rect.plot_plotly_many(fig_many, f.rect, dx=1, dy=-2)
+        np.testing.assert_array_equal(fig_many.data[0].x, np.concatenate([(*t.x, np.nan) for t in fig_each.data]))
+        np.testing.assert_array_equal(fig_many.data[0].y, np.concatenate([(*t.y, np.nan) for t in fig_each.data]))
+
     def test_mutator(self) -> None:
         """
         Test floor mutator.
         """
-        f = DbLoader(DB_PATH).floors[0]
+        f = copy.deepcopy(self.db.floors[0])
 
         def test(x: float, y: float):
             p = f.rect[0].get_mass_center()
@@ -92,11 +213,33 @@ class DbLoaderTest(unittest.TestCase):
         f.mutate()
         test(83.1, -6.3)
 
+    def _assert_photo_close(
+            self,
+            image: 'np.ndarray',
+            reference: 'np.ndarray',
+            max_mean: float = 0.5,
+            level: int = 8,
+            max_frac: float = 1e-3
+    ) -> None:
+        """
+        Assert a photo crop is close to a reference crop, as the interpolation can change the pixels at the edges.
+
+        :param image: Photo crop
+        :param reference: Reference crop
+        :param max_mean: Maximum mean absolute difference
+        :param level: Difference of a value to be counted as different
+        :param max_frac: Maximum fraction of different values
+        """
+        self.assertEqual(image.shape, reference.shape)
+        diff = np.abs(image.astype(np.int16) - reference)
+        self.assertLess(np.mean(diff), max_mean)
+        self.assertLess(np.mean(diff > level), max_frac)
+
     def test_image(self) -> None:
         """
         Test image obtain in binary/photo.
         """
-        f = DbLoader(DB_PATH).floors
+        f = self.db.floors
 
         image_binary = RectBinaryImage(image_size_px=256).init()
         image_photo = RectFloorPhoto(image_size_px=256)
@@ -108,19 +251,170 @@ class DbLoaderTest(unittest.TestCase):
         image_binary.make_rect(r)
         image_photo.make_rect(r)
 
-        self.assertEqual(np.sum(image_binary._images[0]), 2708)
-        self.assertEqual(np.sum(image_binary._images[1]), 6332)
+        self.assertEqual(np.sum(image_binary.get_images()[0]), 2316)
+        self.assertEqual(np.sum(image_binary.get_images()[1]), 5544)
+        self.assertEqual(image_binary.count_pixels(0), 2316)
+        self.assertEqual(image_binary.count_pixels(1), 5544)
+        batch = image_binary.make_rects([f[0].rect[3], f[1].rect[0]])
+        self.assertEqual([i for i, _ in batch], [2, 3])
+        self.assertTrue(np.array_equal(batch[0][1], image_binary.get_images()[0]))
+        self.assertTrue(np.array_equal(batch[1][1], image_binary.get_images()[1]))
 
-        self.assertEqual(np.sum(image_photo._images[0]), 284580)
-        self.assertEqual(np.sum(image_photo._images[1]), 883326)
+        # Crops of version 0.3.1 (OpenCV 4.5.1) of floor 0 rect 3, floor 1 rect 0, and floor 0 rotated 30 degrees
+        # rect 3. The crop and rotation changes of 0.4.0 move a few edge pixels (see the changelog)
+        reference = np.load(os.path.join(os.path.dirname(DB_PATH), 'photo_reference.npz'))['data']
+        self._assert_photo_close(image_photo._images[0], reference[0])
+        self._assert_photo_close(image_photo._images[1], reference[1])
+        f_rot = copy.deepcopy(f[0])
+        f_rot.mutate(30)
+        self._assert_photo_close(RectFloorPhoto(image_size_px=256).make_rect(f_rot.rect[3])[1], reference[2])
+        batch = image_photo.make_rects([f[0].rect[3], f[1].rect[0]])
+        self.assertTrue(np.array_equal(batch[0][1], image_photo._images[0]))
+        self.assertTrue(np.array_equal(batch[1][1], image_photo._images[1]))
+        images = image_photo.get_images()
+        images[:] = 0  # It returns a copy, thus, the stored images are not modified
+        self.assertTrue(np.array_equal(image_photo.get_images()[0], batch[0][1]))
 
         # Export
-        if not os.path.isdir('.out'):
-            os.mkdir('.out')
-        image_binary.export('.out/binary')
-        image_photo.export('.out/photo')
+        with tempfile.TemporaryDirectory() as tmp:
+            image_binary.export(os.path.join(tmp, 'binary'))
+            image_photo.export(os.path.join(tmp, 'photo'))
+            self.assertTrue(os.path.isfile(os.path.join(tmp, 'binary_256.npz')))
+            self.assertTrue(os.path.isfile(os.path.join(tmp, 'photo_256_files.csv')))
 
         # Now exporters must be closed
         self.assertEqual(len(image_binary.get_images()), 0)
         self.assertEqual(len(image_photo.get_images()), 0)
         image_binary.restore_plot()
+
+    def test_image_packbits(self) -> None:
+        """
+        Test the packed binary export restores the same images.
+        """
+        image = RectBinaryImage(image_size_px=64).init()
+        rects = [self.db.floors[0].rect[3], self.db.floors[1].rect[0], self.db.floors[3].rect[2]]
+        image.make_rects(rects)
+        images = image.get_images()
+        self.assertEqual(images.shape, (3, 64, 64))
+        with tempfile.TemporaryDirectory() as tmp:
+            image.export(os.path.join(tmp, 'binary'), packbits=True)
+            data = np.load(os.path.join(tmp, 'binary_64.npz'))['data']
+        self.assertEqual(data.shape, (3, 64, 8))
+        np.testing.assert_array_equal(np.unpackbits(data, axis=-1, count=64), images)
+        image.restore_plot()
+
+    def test_image_photo_cache(self) -> None:
+        """
+        Test the disk cache of the photo images, the images must be equal to the images without cache.
+        """
+        rects = [self.db.floors[0].rect[3], self.db.floors[1].rect[0]]
+        expected = [array for _, array in RectFloorPhoto(image_size_px=64).make_rects(rects)]
+        with tempfile.TemporaryDirectory() as tmp:
+            for _ in range(2):  # Cold, then warm
+                image = RectFloorPhoto(image_size_px=64, cache_path=tmp)
+                for (_, array), array_e in zip(image.make_rects(rects), expected):
+                    self.assertTrue(np.array_equal(array, array_e))
+            self.assertEqual(len(os.listdir(tmp)), 2)
+
+            # Floors from other datasets can share the same ID
+            f = copy.deepcopy(self.db.floors[1])
+            f.id = self.db.floors[0].id
+            image = RectFloorPhoto(image_size_px=64, cache_path=tmp)
+            self.assertTrue(np.array_equal(image.make_rect(f.rect[0])[1], expected[1]))
+            self.assertEqual(len(os.listdir(tmp)), 3)
+
+            def parsed(rect: 'Rect') -> bool:
+                """
+                Crop the rect without cache in memory, and check whether the floor image was parsed.
+                """
+                with mock.patch.object(RectFloorPhoto, '_parse_image', autospec=True,
+                                       side_effect=RectFloorPhoto._parse_image) as m:
+                    array = RectFloorPhoto(image_size_px=64, cache_path=tmp).make_rect(rect)[1]
+                self.assertTrue(np.array_equal(array, expected[rects.index(rect)]))
+                return m.called
+
+            # A new library version invalidates the cache, and the stale file is removed
+            files = set(os.listdir(tmp))
+            self.assertFalse(parsed(rects[0]))
+            with mock.patch.object(_rect_photo, '__version__', '0.0.0'):
+                self.assertTrue(parsed(rects[0]))
+            self.assertEqual(len(os.listdir(tmp)), 3)
+            self.assertNotEqual(set(os.listdir(tmp)), files)
+            self.assertTrue(parsed(rects[0]))
+            self.assertFalse(parsed(rects[0]))
+            self.assertEqual(set(os.listdir(tmp)), files)
+
+            # A new floor scale leaves a single file of the floor
+            f = copy.deepcopy(self.db.floors[1])
+            f.mutate(sx=2)
+            RectFloorPhoto(image_size_px=64, cache_path=tmp).make_rect(f.rect[0])
+            self.assertEqual(len(os.listdir(tmp)), 3)
+            self.assertFalse(parsed(rects[0]))
+            self.assertTrue(parsed(rects[1]))
+
+    def test_image_photo_reduce(self) -> None:
+        """
+        Test photo crops of floor images decoded at a reduced size are close to the full size crops.
+        """
+        rects = [self.db.floors[0].rect[3], self.db.floors[1].rect[0], self.db.floors[3].rect[2]]
+        expected = [array for _, array in RectFloorPhoto(image_size_px=64).make_rects(rects)]
+        for (_, array), array_e in zip(RectFloorPhoto(image_size_px=64, reduce_factor=2).make_rects(rects), expected):
+            self._assert_photo_close(array, array_e, max_mean=2, level=32, max_frac=0.02)
+
+    def test_image_photo_pyramid(self) -> None:
+        """
+        Test photo crops from the image pyramid are close to the crops from the full size image.
+        """
+        rects = [self.db.floors[0].rect[3], self.db.floors[1].rect[0], self.db.floors[3].rect[2]]
+        expected = [array for _, array in RectFloorPhoto(image_size_px=64).make_rects(rects)]
+        image = RectFloorPhoto(image_size_px=64, pyramid_levels=1)
+        for (_, array), array_e in zip(image.make_rects(rects), expected):
+            self._assert_photo_close(array, array_e, max_mean=2, level=32, max_frac=0.02)
+        self.assertEqual(len(image._floor_images[image._get_floor_hash(rects[0].floor)]), 2)
+
+    def test_image_mask(self) -> None:
+        """
+        Test binary images against the rect polygons. Pixels whose center lies within a rect must be walls, and the
+        other wall pixels must lie on the rect outlines.
+        """
+        image = RectBinaryImage(image_size_px=256).init()
+        s, kernel = 256, np.ones((3, 3), dtype=np.uint8)
+        for r in (self.db.floors[0].rect[3], self.db.floors[1].rect[0], self.db.floors[2].rect[5]):
+            _, array = image.make_rect(r)
+            c = r.get_mass_center()
+            xmin, xmax, ymin, ymax = image._get_viewport(c.x - 5, c.x + 5, c.y - 5, c.y + 5)
+
+            # Pixel centers, including a margin of one pixel
+            t = np.arange(-1, s + 1) + 0.5
+            x, y = np.meshgrid(xmin + t * (xmax - xmin) / s, ymax - t * (ymax - ymin) / s)
+            inside = np.zeros(x.shape, dtype=np.uint8)
+            for p in r.floor.get_rect_polygons():  # Rects are convex, inner points lie on the same side of all edges
+                e = np.roll(p, -1, axis=0) - p
+                cross = e[:, 0, None, None] * (y - p[:, 1, None, None]) - \
+                    e[:, 1, None, None] * (x - p[:, 0, None, None])
+                inside |= np.all(cross >= 0, axis=0) | np.all(cross <= 0, axis=0)
+            outline = (cv2.dilate(inside, kernel) != cv2.erode(inside, kernel))[1:-1, 1:-1]
+            inside = inside[1:-1, 1:-1]
+
+            self.assertGreater(np.sum(inside), 0)
+            self.assertTrue(np.all(array[inside == 1] == 1))
+            self.assertTrue(np.all(outline[array != inside]))
+
+    def test_image_canvas(self) -> None:
+        """
+        Test binary regions cropped from the floor canvas are equal to the regions filled directly.
+        """
+        rects = [r for f in self.db.floors for r in f.rect]
+        image_canvas = RectBinaryImage(image_size_px=256).init()
+        image_direct = RectBinaryImage(image_size_px=256).init()
+
+        # All the rects of a floor share the same canvas
+        image_canvas.make_rects(self.db.floors[0].rect)
+        self.assertEqual(len(image_canvas._plot), 1)
+
+        with mock.patch.object(_rect_binary, 'MAX_CANVAS_PX', 0):  # Regions are filled from the floor vertices
+            direct = image_direct.make_rects(rects)
+            direct_r = image_direct.make_rect(rects[-1])
+        for (_, canvas), (_, array) in zip(image_canvas.make_rects(rects), direct):
+            self.assertTrue(np.array_equal(canvas, array))
+        self.assertTrue(np.array_equal(image_canvas.make_rect(rects[-1])[1], direct_r[1]))
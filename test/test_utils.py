@@ -0,0 +1,138 @@
+"""
+MLSTRUCTFP - TEST - UTILS
+
+Test the geometry utils, the vectorized helpers must be equivalent to the point and line objects.
+"""
+
+import math
+import numpy as np
+import unittest
+
+from MLStructFP.utils import *
+from MLStructFP._types import List
+
+
+def _random_points(n: int, seed: int = 0) -> List['GeomPoint2D']:
+    """
+    Create random points.
+
+    :param n: Number of points
+    :param seed: Random seed
+    :return: Point list
+    """
+    return [GeomPoint2D(x, y) for x, y in np.random.default_rng(seed).uniform(-10, 10, (n, 2)).tolist()]
+
+
+class GeometryTest(unittest.TestCase):
+
+    def test_point_array(self) -> None:
+        """
+        Test point array against the point list.
+        """
+        points = _random_points(50)
+        pa = PointArray.from_points(points)
+        self.assertEqual(len(pa), 50)
+        for i, p in enumerate(points):
+            self.assertEqual(pa[i], p)
+        self.assertEqual(len(PointArray([], [])), 0)
+
+        # Bulk operations
+        c = GeomPoint2D(1, -2)
+        self.assertTrue(np.allclose(c.dist(pa), [c.dist(p) for p in points]))
+        self.assertTrue(np.allclose(c.dist(np.array([p.list() for p in points])), [c.dist(p) for p in points]))
+        self.assertTrue(np.allclose(c.angle(pa), [c.angle(p) for p in points]))
+        self.assertTrue(np.allclose(c.angle(points), [c.angle(p) for p in points]))
+        line = GeomLine2D().from_2_points(GeomPoint2D(-1, 3), GeomPoint2D(4, 1))
+        self.assertTrue(np.allclose(line.ortho_distance_point_list(pa), [line.ortho_distance_point(p) for p in points]))
+        self.assertTrue(np.allclose(line.ortho_distance_point_list(points), line.ortho_distance_point_list(pa)))
+
+    def test_bounding_box(self) -> None:
+        """
+        Test the vectorized bounding box construction and intersection.
+        """
+        points = _random_points(20)
+        bb = BoundingBox.from_points_array([p.x for p in points], [p.y for p in points])
+        self.assertEqual(bb.xmin, min(p.x for p in points))
+        self.assertEqual(bb.xmax, max(p.x for p in points))
+        self.assertEqual(bb.ymin, min(p.y for p in points))
+        self.assertEqual(bb.ymax, max(p.y for p in points))
+
+        # Intersection against a scalar check, including touching boxes
+        bbs = []
+        for x1, x2, y1, y2 in np.random.default_rng(1).uniform(-15, 15, (200, 4)).tolist():
+            bbs.append(BoundingBox(min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)))
+        bbs.append(BoundingBox(bb.xmax, bb.xmax + 1, bb.ymin, bb.ymax))
+        stacked = BoundingBox.stack(bbs)
+        self.assertEqual(stacked.shape, (len(bbs), 4))
+        self.assertEqual(BoundingBox.stack([]).shape, (0, 4))
+        expected = [not (b.xmax < bb.xmin or b.xmin > bb.xmax or b.ymax < bb.ymin or b.ymin > bb.ymax) for b in bbs]
+        self.assertEqual(bb.intersects_many(stacked).tolist(), expected)
+        self.assertTrue(expected[-1])
+
+    def test_rotate(self) -> None:
+        """
+        Test the precomputed and vectorized rotations against the point rotation.
+        """
+        points = _random_points(30)
+        c = GeomPoint2D(2, 3)
+        for angle in (0, 30, -135, 90):
+            r = angle * math.pi / 180
+            rotated = [p.clone().rotate(c, angle) for p in points]
+            for p, p_r in zip(points, rotated):
+                self.assertEqual(p.clone().rotate_precomputed(c, math.sin(r), math.cos(r)), p_r)
+            pa = PointArray.from_points(points).rotate(c, angle)
+            for i, p_r in enumerate(rotated):
+                self.assertAlmostEqual(pa[i].x, p_r.x, places=12)
+                self.assertAlmostEqual(pa[i].y, p_r.y, places=12)
+
+    def test_point_left(self) -> None:
+        """
+        Test the vectorized point side check against the point check.
+        """
+        points = _random_points(100)
+        for p1, p2 in ((GeomPoint2D(-1, 3), GeomPoint2D(4, 1)), (GeomPoint2D(0, -5), GeomPoint2D(0, 5))):
+            line = GeomLine2D().from_2_points(p1, p2)
+            left = line.point_left_many([p.x for p in points], [p.y for p in points])
+            self.assertEqual(left.tolist(), [line.point_left(p) for p in points])
+            self.assertTrue(0 < np.sum(left) < len(points))
+
+    def test_plot_many(self) -> None:
+        """
+        Test plotting several points as a single artist draws the same markers as plotting each point.
+        """
+        from matplotlib.figure import Figure  # No pyplot figure, thus, the backend is not used
+        points = _random_points(25)
+        ax_many, ax_each = Figure().add_subplot(), Figure().add_subplot()
+        GeomPoint2D.plot_many(ax_many, points, color='#ff0000', marker_size=4)
+        GeomPoint2D.plot_many(ax_many, PointArray.from_points(points))
+        for p in points:
+            p.plot(ax_each, color='#ff0000', marker_size=4)
+        self.assertEqual(len(ax_many.lines), 2)
+        self.assertEqual(len(ax_each.lines), len(points))
+        each = np.array([line.get_xydata()[0] for line in ax_each.lines])
+        for line in ax_many.lines:
+            self.assertTrue(np.array_equal(line.get_xydata(), each))
+        self.assertEqual(ax_many.lines[0].get_color(), ax_each.lines[0].get_color())
+        self.assertEqual(ax_many.lines[0].get_markersize(), ax_each.lines[0].get_markersize())
+        self.assertEqual(ax_many.lines[0].get_linestyle(), 'None')
+
+    def test_line_array(self) -> None:
+        """
+        Test line array against the lines created from two points.
+        """
+        p1, p2 = _random_points(40, seed=2), _random_points(40, seed=3)
+        p2[0] = GeomPoint2D(p1[0].x, p1[0].y + 1)  # Vertical line
+        lines = [GeomLine2D().from_2_points(a, b) for a, b in zip(p1, p2)]
+        la = LineArray.from_points(PointArray.from_points(p1), PointArray.from_points(p2))
+        self.assertEqual(len(la), len(lines))
+        self.assertTrue(np.allclose(la.m, [line.m for line in lines], rtol=1e-12))
+        self.assertTrue(np.allclose(la.n, [line.n for line in lines], rtol=1e-12))
+        self.assertTrue(np.allclose(la.theta, [line.theta for line in lines], rtol=1e-12))
+
+        # Distances, and the lines created from the array
+        p = GeomPoint2D(0.5, -1.5)
+        self.assertTrue(np.allclose(la.ortho_distance_point(p), [line.ortho_distance_point(p) for line in lines]))
+        for i in (1, 7, 39):
+            line = la[i]
+            self.assertEqual((line.m, line.n, line.theta), (la.m[i], la.n[i], la.theta[i]))
+            self.assertAlmostEqual(line.ortho_distance_point(p), lines[i].ortho_distance_point(p))